@@ -0,0 +1,434 @@
+"""In-process stand-in for the terratree-products table.
+
+Implements the subset of the boto3 resource/client API the Lambdas use
+(get_item, put_item, update_item, delete_item, query, scan, batch_get_item,
+batch_write_item) including condition, key-condition and update expressions,
+and counts every call so benchmarks can report DynamoDB calls per event.
+"""
+import copy
+import functools
+import re
+import threading
+import time
+from collections import Counter
+
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+from botocore.exceptions import ClientError
+
+TOKEN_RE = re.compile(r'\s*(<>|<=|>=|=|<|>|\(|\)|,|\+|-|[#:]?[A-Za-z_][A-Za-z0-9_]*)')
+_MISSING = object()
+
+
+def _tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = TOKEN_RE.match(expression, position)
+        if not match:
+            raise ValueError(f"Cannot parse expression at {expression[position:]!r}")
+        tokens.append(match.group(1))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    """Recursive-descent parser that compiles DynamoDB expressions into Python callables"""
+
+    def __init__(self, expression):
+        self.tokens = _tokenize(expression)
+        self.position = 0
+
+    def peek(self, offset=0):
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else None
+
+    def take(self, expected=None):
+        token = self.peek()
+        if expected is not None and (token is None or token.upper() != expected):
+            raise ValueError(f"Expected {expected}, got {token}")
+        self.position += 1
+        return token
+
+    def at_keyword(self, *keywords):
+        token = self.peek()
+        return token is not None and token.upper() in keywords
+
+    # Operands evaluate to a function of (item, names, values)
+
+    def path(self):
+        token = self.take()
+        if token.startswith('#'):
+            return lambda item, names, values: names[token]
+        return lambda item, names, values: token
+
+    def operand(self):
+        token = self.peek()
+        if token.startswith(':'):
+            self.take()
+            return lambda item, names, values: values[token]
+        if token.lower() == 'if_not_exists':
+            self.take()
+            self.take('(')
+            path = self.path()
+            self.take(',')
+            default = self.operand()
+            self.take(')')
+            return lambda item, names, values: (
+                item[path(item, names, values)] if path(item, names, values) in item else default(item, names, values)
+            )
+        if token.lower() == 'size':
+            self.take()
+            self.take('(')
+            path = self.path()
+            self.take(')')
+            return lambda item, names, values: len(item.get(path(item, names, values), ()))
+        path = self.path()
+        return lambda item, names, values: item.get(path(item, names, values), _MISSING)
+
+    def value(self):
+        left = self.operand()
+        if self.peek() in ('+', '-'):
+            op = self.take()
+            right = self.operand()
+            if op == '+':
+                return lambda item, names, values: left(item, names, values) + right(item, names, values)
+            return lambda item, names, values: left(item, names, values) - right(item, names, values)
+        return left
+
+    # Conditions evaluate to a bool
+
+    def condition(self):
+        left = self.conjunction()
+        while self.at_keyword('OR'):
+            self.take()
+            right = self.conjunction()
+            left = (lambda a, b: lambda *args: a(*args) or b(*args))(left, right)
+        return left
+
+    def conjunction(self):
+        left = self.negation()
+        while self.at_keyword('AND'):
+            self.take()
+            right = self.negation()
+            left = (lambda a, b: lambda *args: a(*args) and b(*args))(left, right)
+        return left
+
+    def negation(self):
+        if self.at_keyword('NOT'):
+            self.take()
+            inner = self.negation()
+            return lambda *args: not inner(*args)
+        return self.primary()
+
+    def primary(self):
+        token = self.peek()
+        if token == '(':
+            self.take()
+            inner = self.condition()
+            self.take(')')
+            return inner
+
+        function = token.lower()
+        if function in ('attribute_exists', 'attribute_not_exists', 'begins_with') and self.peek(1) == '(':
+            self.take()
+            self.take('(')
+            path = self.path()
+            if function == 'begins_with':
+                self.take(',')
+                prefix = self.operand()
+                self.take(')')
+                return lambda item, names, values: str(item.get(path(item, names, values), '')).startswith(
+                    prefix(item, names, values)
+                ) and path(item, names, values) in item
+            self.take(')')
+            if function == 'attribute_exists':
+                return lambda item, names, values: path(item, names, values) in item
+            return lambda item, names, values: path(item, names, values) not in item
+
+        left = self.operand()
+        if self.at_keyword('BETWEEN'):
+            self.take()
+            low = self.operand()
+            self.take('AND')
+            high = self.operand()
+            return lambda *args: _compare('>=', left(*args), low(*args)) and _compare('<=', left(*args), high(*args))
+
+        op = self.take()
+        right = self.operand()
+        return lambda *args: _compare(op, left(*args), right(*args))
+
+    # Update expressions apply SET/REMOVE/ADD actions in place
+
+    def update(self):
+        actions = []
+        while self.peek() is not None:
+            clause = self.take().upper()
+            while True:
+                path = self.path()
+                if clause == 'SET':
+                    self.take('=')
+                    actions.append(('SET', path, self.value()))
+                elif clause == 'REMOVE':
+                    actions.append(('REMOVE', path, None))
+                elif clause == 'ADD':
+                    actions.append(('ADD', path, self.operand()))
+                else:
+                    raise ValueError(f"Unsupported update clause {clause}")
+                if self.peek() != ',':
+                    break
+                self.take(',')
+
+        def apply(item, names, values):
+            # Evaluate every right-hand side against the original item, as DynamoDB does
+            original = dict(item)
+            for action, path, value in actions:
+                name = path(original, names, values)
+                if action == 'SET':
+                    item[name] = value(original, names, values)
+                elif action == 'REMOVE':
+                    item.pop(name, None)
+                else:
+                    item[name] = original.get(name, 0) + value(original, names, values)
+        return apply
+
+
+def _compare(op, left, right):
+    if left is _MISSING or right is _MISSING:
+        return False
+    try:
+        if op == '=':
+            return left == right
+        if op == '<>':
+            return left != right
+        if op == '<':
+            return left < right
+        if op == '<=':
+            return left <= right
+        if op == '>':
+            return left > right
+        if op == '>=':
+            return left >= right
+    except TypeError:
+        return False
+    raise ValueError(f"Unsupported operator {op}")
+
+
+@functools.lru_cache(maxsize=256)
+def compile_condition(expression):
+    return _Parser(expression).condition()
+
+
+@functools.lru_cache(maxsize=256)
+def compile_update(expression):
+    return _Parser(expression).update()
+
+
+def _resolve_condition(condition, names, values, is_key_condition=False):
+    """Accept either an expression string or a boto3 condition object"""
+    if isinstance(condition, ConditionBase):
+        built = ConditionExpressionBuilder().build_expression(condition, is_key_condition=is_key_condition)
+        names = {**(names or {}), **built.attribute_name_placeholders}
+        values = {**(values or {}), **built.attribute_value_placeholders}
+        condition = built.condition_expression
+    return compile_condition(condition), names or {}, values or {}
+
+
+def _conditional_check_failed(operation):
+    return ClientError(
+        {'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'The conditional request failed'}},
+        operation
+    )
+
+
+class FakeTable:
+    """One table: items keyed by (hash, range), plus GSIs declared as {name: (hash_attr, range_attr)}"""
+
+    def __init__(self, database, name, hash_key='asin', range_key='marketplace_id', indexes=None, page_size=100):
+        self.database = database
+        self.name = name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.indexes = indexes or {}
+        self.page_size = page_size
+        self.items = {}
+        self.lock = threading.RLock()
+        self.meta = type('Meta', (), {'client': database.client})()
+
+    def _key(self, key):
+        return key[self.hash_key], key.get(self.range_key)
+
+    def _primary_key(self, item):
+        key = {self.hash_key: item[self.hash_key]}
+        if self.range_key:
+            key[self.range_key] = item[self.range_key]
+        return key
+
+    def _check(self, item, kwargs, operation):
+        if 'ConditionExpression' in kwargs:
+            condition, names, values = _resolve_condition(
+                kwargs['ConditionExpression'],
+                kwargs.get('ExpressionAttributeNames'),
+                kwargs.get('ExpressionAttributeValues')
+            )
+            if not condition(item, names, values):
+                raise _conditional_check_failed(operation)
+
+    def get_item(self, Key, **kwargs):
+        self.database.record('GetItem')
+        with self.lock:
+            item = self.items.get(self._key(Key))
+            return {'Item': copy.deepcopy(item)} if item is not None else {}
+
+    def put_item(self, Item, **kwargs):
+        self.database.record('PutItem')
+        with self.lock:
+            key = self._key(Item)
+            self._check(self.items.get(key, {}), kwargs, 'PutItem')
+            self.items[key] = copy.deepcopy(Item)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, **kwargs):
+        self.database.record('UpdateItem')
+        with self.lock:
+            key = self._key(Key)
+            item = copy.deepcopy(self.items.get(key, dict(Key)))
+            self._check(self.items.get(key, {}), kwargs, 'UpdateItem')
+            compile_update(UpdateExpression)(
+                item, kwargs.get('ExpressionAttributeNames', {}), kwargs.get('ExpressionAttributeValues', {})
+            )
+            self.items[key] = item
+            return {'Attributes': copy.deepcopy(item)} if kwargs.get('ReturnValues', 'NONE') != 'NONE' else {}
+
+    def delete_item(self, Key, **kwargs):
+        self.database.record('DeleteItem')
+        with self.lock:
+            key = self._key(Key)
+            self._check(self.items.get(key, {}), kwargs, 'DeleteItem')
+            self.items.pop(key, None)
+        return {}
+
+    def _page(self, candidates, kwargs, sort_key=None):
+        start = kwargs.get('ExclusiveStartKey')
+        if start:
+            position = next(
+                (i + 1 for i, item in enumerate(candidates) if self._key(item) == self._key(start)),
+                len(candidates)
+            )
+            candidates = candidates[position:]
+
+        page = candidates[:kwargs.get('Limit', self.page_size)]
+        if 'FilterExpression' in kwargs:
+            condition, names, values = _resolve_condition(
+                kwargs['FilterExpression'], kwargs.get('ExpressionAttributeNames'), kwargs.get('ExpressionAttributeValues')
+            )
+            matched = [item for item in page if condition(item, names, values)]
+        else:
+            matched = page
+
+        response = {'Count': len(matched), 'ScannedCount': len(page)}
+        if kwargs.get('Select') != 'COUNT':
+            response['Items'] = copy.deepcopy(matched)
+        if len(page) < len(candidates):
+            last_key = self._primary_key(page[-1])
+            if sort_key:
+                last_key.update({attr: page[-1][attr] for attr in sort_key if attr})
+            response['LastEvaluatedKey'] = last_key
+        return response
+
+    def query(self, KeyConditionExpression, IndexName=None, **kwargs):
+        self.database.record('Query')
+        condition, names, values = _resolve_condition(
+            KeyConditionExpression, kwargs.get('ExpressionAttributeNames'), kwargs.get('ExpressionAttributeValues'),
+            is_key_condition=True
+        )
+        hash_attr, range_attr = self.indexes[IndexName] if IndexName else (self.hash_key, self.range_key)
+        with self.lock:
+            candidates = [
+                item for item in self.items.values()
+                if hash_attr in item and (not range_attr or range_attr in item) and condition(item, names, values)
+            ]
+        if range_attr:
+            candidates.sort(key=lambda item: item[range_attr], reverse=not kwargs.get('ScanIndexForward', True))
+        return self._page(candidates, kwargs, (hash_attr, range_attr))
+
+    def scan(self, **kwargs):
+        self.database.record('Scan')
+        with self.lock:
+            candidates = list(self.items.values())
+        return self._page(candidates, kwargs)
+
+
+class FakeClient:
+    """Low-level client view of the fake database, as exposed on Table.meta.client"""
+
+    def __init__(self, database):
+        self.database = database
+
+    def get_item(self, TableName, **kwargs):
+        return self.database.tables[TableName].get_item(**kwargs)
+
+    def put_item(self, TableName, **kwargs):
+        return self.database.tables[TableName].put_item(**kwargs)
+
+    def update_item(self, TableName, **kwargs):
+        return self.database.tables[TableName].update_item(**kwargs)
+
+    def delete_item(self, TableName, **kwargs):
+        return self.database.tables[TableName].delete_item(**kwargs)
+
+    def query(self, TableName, **kwargs):
+        return self.database.tables[TableName].query(**kwargs)
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        self.database.record('BatchGetItem')
+        responses = {}
+        for table_name, request in RequestItems.items():
+            table = self.database.tables[table_name]
+            with table.lock:
+                responses[table_name] = [
+                    copy.deepcopy(table.items[table._key(key)])
+                    for key in request['Keys'] if table._key(key) in table.items
+                ]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        self.database.record('BatchWriteItem')
+        for table_name, requests in RequestItems.items():
+            table = self.database.tables[table_name]
+            with table.lock:
+                for request in requests:
+                    if 'PutRequest' in request:
+                        item = request['PutRequest']['Item']
+                        table.items[table._key(item)] = copy.deepcopy(item)
+                    else:
+                        table.items.pop(table._key(request['DeleteRequest']['Key']), None)
+        return {'UnprocessedItems': {}}
+
+
+class FakeDynamoDB:
+    """Drop-in for boto3.resource('dynamodb') holding any number of FakeTables"""
+
+    def __init__(self, latency_ms=0.0):
+        self.latency_ms = latency_ms
+        self.calls = Counter()
+        self.calls_lock = threading.Lock()
+        self.client = FakeClient(self)
+        self.tables = {}
+
+    def create_table(self, name, **kwargs):
+        self.tables[name] = FakeTable(self, name, **kwargs)
+        return self.tables[name]
+
+    def Table(self, name):
+        return self.tables[name]
+
+    def record(self, operation):
+        with self.calls_lock:
+            self.calls[operation] += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+
+    def reset_calls(self):
+        with self.calls_lock:
+            self.calls.clear()
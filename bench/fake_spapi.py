@@ -0,0 +1,189 @@
+"""Local stand-in for the LWA token endpoint, the Listings API and the Feeds API.
+
+Runs a threaded HTTP server on localhost with configurable per-request
+latency and 429 injection, and sends x-amzn-RateLimit-Limit on every SP-API
+response so the client's adaptive limiter can be exercised offline.
+"""
+import gzip
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LISTINGS_PATH = re.compile(r'^/listings/2021-08-01/items/(?P<asin>[^/?]+)')
+FEED_PATH = re.compile(r'^/feeds/2021-06-30/feeds/(?P<feed_id>[^/?]+)$')
+DOCUMENT_PATH = re.compile(r'^/feeds/2021-06-30/documents/(?P<document_id>[^/?]+)$')
+BLOB_PATH = re.compile(r'^/blobs/(?P<document_id>[^/?]+)$')
+
+
+class FakeSPAPIServer:
+    """Threaded fake of the SP-API endpoints the patcher calls
+
+    latency_ms: fixed delay added to every SP-API request
+    throttle_rate: probability that a SP-API request is answered with 429
+    rate_limit: value sent in x-amzn-RateLimit-Limit
+    failure_rate: probability that a PATCH returns 400 (a non-retryable rejection)
+    """
+
+    def __init__(self, latency_ms=50.0, throttle_rate=0.0, rate_limit=5.0, failure_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.throttle_rate = throttle_rate
+        self.rate_limit = rate_limit
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.counts = Counter()
+        self.patched = {}
+        self.documents = {}
+        self.feeds = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server.server_port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def roll(self, probability):
+        with self.lock:
+            return self.random.random() < probability
+
+    def _process_feed(self, feed_id):
+        """Apply a submitted JSON_LISTINGS_FEED and store its processing report"""
+        feed = self.feeds[feed_id]
+        document = json.loads(self.documents[feed['inputFeedDocumentId']])
+        issues = []
+        for message in document.get('messages', []):
+            if self.roll(self.failure_rate):
+                issues.append({'messageId': message['messageId'], 'code': '4000001', 'severity': 'ERROR',
+                               'message': 'Injected failure'})
+            else:
+                self.patched[message['sku']] = message['patches']
+        report_id = str(uuid.uuid4())
+        self.documents[report_id] = gzip.compress(json.dumps({
+            'header': document.get('header', {}),
+            'issues': issues,
+            'summary': {'messagesProcessed': len(document.get('messages', [])), 'errors': len(issues)}
+        }).encode('utf-8'))
+        feed.update({'processingStatus': 'DONE', 'resultFeedDocumentId': report_id})
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return self.rfile.read(length) if length else b''
+
+            def _reply(self, status, payload=None, raw=None, rate_limited=True):
+                data = raw if raw is not None else json.dumps(payload or {}).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                if rate_limited:
+                    self.send_header('x-amzn-RateLimit-Limit', str(fake.rate_limit))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _spapi_gate(self):
+                """Apply latency and 429 injection; returns False when the request was throttled"""
+                if fake.latency_ms:
+                    time.sleep(fake.latency_ms / 1000.0)
+                if fake.roll(fake.throttle_rate):
+                    fake.count('throttled')
+                    self._reply(429, {'errors': [{'code': 'QuotaExceeded'}]})
+                    return False
+                return True
+
+            def do_POST(self):
+                body = self._body()
+                if self.path.startswith('/auth/o2/token'):
+                    fake.count('token')
+                    self._reply(200, {'access_token': 'Atza|fake', 'expires_in': 3600}, rate_limited=False)
+                    return
+                if not self._spapi_gate():
+                    return
+                if self.path == '/feeds/2021-06-30/documents':
+                    fake.count('createFeedDocument')
+                    document_id = str(uuid.uuid4())
+                    self._reply(201, {'feedDocumentId': document_id, 'url': f'{fake.url}/blobs/{document_id}'})
+                elif self.path == '/feeds/2021-06-30/feeds':
+                    fake.count('createFeed')
+                    feed_id = str(uuid.uuid4())
+                    fake.feeds[feed_id] = {**json.loads(body), 'feedId': feed_id, 'processingStatus': 'IN_PROGRESS'}
+                    self._reply(202, {'feedId': feed_id})
+                else:
+                    self._reply(404)
+
+            def do_PUT(self):
+                body = self._body()
+                match = BLOB_PATH.match(self.path)
+                if not match:
+                    self._reply(404, rate_limited=False)
+                    return
+                fake.documents[match.group('document_id')] = body
+                self._reply(200, raw=b'', rate_limited=False)
+
+            def do_GET(self):
+                blob = BLOB_PATH.match(self.path)
+                if blob:
+                    self._reply(200, raw=fake.documents.get(blob.group('document_id'), b''), rate_limited=False)
+                    return
+                if not self._spapi_gate():
+                    return
+                feed = FEED_PATH.match(self.path)
+                document = DOCUMENT_PATH.match(self.path)
+                if feed and feed.group('feed_id') in fake.feeds:
+                    fake.count('getFeed')
+                    feed_id = feed.group('feed_id')
+                    if fake.feeds[feed_id]['processingStatus'] != 'DONE':
+                        fake._process_feed(feed_id)
+                    self._reply(200, fake.feeds[feed_id])
+                elif document:
+                    fake.count('getFeedDocument')
+                    document_id = document.group('document_id')
+                    self._reply(200, {'feedDocumentId': document_id, 'url': f'{fake.url}/blobs/{document_id}',
+                                      'compressionAlgorithm': 'GZIP'})
+                else:
+                    self._reply(404)
+
+            def do_PATCH(self):
+                body = self._body()
+                match = LISTINGS_PATH.match(self.path)
+                if not match:
+                    self._reply(404)
+                    return
+                if not self._spapi_gate():
+                    return
+                fake.count('patch')
+                if fake.roll(fake.failure_rate):
+                    fake.count('patch_rejected')
+                    self._reply(400, {'errors': [{'code': 'InvalidInput'}]})
+                    return
+                with fake.lock:
+                    fake.patched[match.group('asin')] = json.loads(body)
+                self._reply(200, {'status': 'ACCEPTED', 'sku': match.group('asin')})
+
+        return Handler
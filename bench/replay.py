@@ -0,0 +1,93 @@
+"""Synthetic and recorded AnyOfferChangedNotification sources, paced at a target rate."""
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+OUR_SELLER_ID = 'AERPN1UM8O1I4'
+MARKETPLACE_ID = 'ATVPDKIKX0DER'
+
+
+def catalog(size, seed=0, marketplace_ids=(MARKETPLACE_ID,)):
+    """Build `size` synthetic products with the attributes the Glue ETL loads, spread round-robin over marketplaces"""
+    rng = random.Random(seed)
+    products = []
+    for i in range(size):
+        retail = round(rng.uniform(5, 500), 2)
+        products.append({
+            'asin': f'B{i:09d}',
+            'marketplace_id': marketplace_ids[i % len(marketplace_ids)],
+            'retail_price': retail,
+            'min_price': round(retail * 0.7, 2),
+            'max_price': round(retail * 1.3, 2),
+            'business_price': round(retail * 0.98, 2),
+            'currentPrice': retail
+        })
+    return products
+
+
+def synthetic_notifications(products, count, seed=0, hot_fraction=0.1, hot_share=0.8, sellers=5,
+                            start=None):
+    """Yield `count` ANY_OFFER_CHANGED events; `hot_share` of them hit the `hot_fraction` busiest ASINs"""
+    rng = random.Random(seed)
+    hot = products[:max(1, int(len(products) * hot_fraction))]
+    event_time = start or datetime.now(timezone.utc)
+
+    for _ in range(count):
+        product = rng.choice(hot) if rng.random() < hot_share else rng.choice(products)
+        event_time += timedelta(milliseconds=rng.randint(1, 50))
+        base = product['retail_price']
+
+        offers = []
+        for s in range(rng.randint(1, sellers)):
+            offers.append({
+                'SellerId': f'SELLER{s:03d}',
+                'SubCondition': 'new',
+                'IsFulfilledByAmazon': rng.random() < 0.5,
+                'ListingPrice': {'Amount': round(base * rng.uniform(0.8, 1.1), 2), 'CurrencyCode': 'USD'}
+            })
+        if rng.random() < 0.7:
+            offers.append({
+                'SellerId': OUR_SELLER_ID,
+                'SubCondition': 'new',
+                'IsFulfilledByAmazon': False,
+                'ListingPrice': {'Amount': base, 'CurrencyCode': 'USD'}
+            })
+        lowest = min(offer['ListingPrice']['Amount'] for offer in offers)
+
+        yield {
+            'NotificationType': 'ANY_OFFER_CHANGED',
+            'EventTime': event_time.strftime('%Y-%m-%dT%H:%M:%S.') + f'{event_time.microsecond // 1000:03d}Z',
+            'Payload': {
+                'AnyOfferChangedNotification': {
+                    'OfferChangeTrigger': {'ASIN': product['asin'], 'MarketplaceId': product['marketplace_id']},
+                    'Summary': {'LowestPrices': [
+                        {'Condition': 'new', 'ListingPrice': {'Amount': lowest, 'CurrencyCode': 'USD'}}
+                    ]},
+                    'Offers': offers
+                }
+            }
+        }
+
+
+def recorded_notifications(path):
+    """Yield notifications from a JSON-lines capture (one SP-API event or EventBridge envelope per line)"""
+    with open(path) as handle:
+        for line in handle:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def paced(events, rate):
+    """Yield events open-loop at `rate` per second; a slow consumer does not lower the offered load"""
+    if not rate:
+        yield from events
+        return
+
+    started = time.perf_counter()
+    for i, event in enumerate(events):
+        delay = started + i / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        yield event
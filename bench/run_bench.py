@@ -0,0 +1,297 @@
+"""Offline replay benchmark for price_update_handler and price_patcher.
+
+Seeds an in-process fake of terratree-products, replays synthetic (or
+recorded) ANY_OFFER_CHANGED notifications through the update handler at a
+target rate, then runs the patcher against a local fake of LWA/SP-API.
+
+    python bench/run_bench.py --products 2000 --events 5000 --rate 1000
+    python bench/run_bench.py --mode single --throttle-rate 0.05 --spapi-latency-ms 80
+    python bench/run_bench.py --recorded notifications.jsonl --json
+
+Requires boto3 and numpy (the Lambdas' own dependencies); no AWS access.
+"""
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'lambda'))
+
+from fake_dynamodb import FakeDynamoDB  # noqa: E402
+from fake_spapi import FakeSPAPIServer  # noqa: E402
+import replay  # noqa: E402
+
+TABLE_NAME = 'terratree-products'
+
+
+class FakeContext:
+    """Minimal Lambda context with a wall-clock time budget"""
+
+    def __init__(self, timeout_seconds):
+        self.aws_request_id = str(uuid.uuid4())
+        self.invoked_function_arn = 'arn:aws:lambda:us-east-1:000000000000:function:bench'
+        self.deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.deadline - time.monotonic()) * 1000))
+
+
+class FakeLambdaClient:
+    """Runs the patcher's asynchronous self-invocations on threads, one simulated container each"""
+
+    def __init__(self, handler, timeout_seconds):
+        self.handler = handler
+        self.timeout_seconds = timeout_seconds
+        self.threads = []
+        self.invocations = 0
+        self.lock = threading.Lock()
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        thread = threading.Thread(target=self.handler, args=(json.loads(Payload), FakeContext(self.timeout_seconds)))
+        with self.lock:
+            self.invocations += 1
+            self.threads.append(thread)
+        thread.start()
+        return {'StatusCode': 202}
+
+    def join(self):
+        """Wait for every invocation, including ones started by the invocations themselves"""
+        while True:
+            with self.lock:
+                pending = [thread for thread in self.threads if thread.is_alive()]
+            if not pending:
+                return
+            for thread in pending:
+                thread.join()
+
+
+class ThreadLocalClients:
+    """Stands in for spapi_client._clients so each simulated container has its own client and limiters"""
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def _clients(self):
+        if not hasattr(self.local, 'clients'):
+            self.local.clients = {}
+        return self.local.clients
+
+    def get(self, endpoint):
+        return self._clients().get(endpoint)
+
+    def __setitem__(self, endpoint, client):
+        self._clients()[endpoint] = client
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def to_dynamo(product):
+    return {key: Decimal(str(value)) if isinstance(value, float) else value for key, value in product.items()}
+
+
+def setup(args):
+    """Start the fakes and import the handlers wired to them"""
+    server = FakeSPAPIServer(
+        latency_ms=args.spapi_latency_ms,
+        throttle_rate=args.throttle_rate,
+        rate_limit=args.rate_limit,
+        failure_rate=args.failure_rate,
+        seed=args.seed
+    ).start()
+
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ['DYNAMODB_TABLE'] = TABLE_NAME
+    os.environ['MARKETPLACE_IDS'] = ','.join(args.marketplaces)
+    # Every region talks to the same fake, each still through its own client and limiters
+    for variable in ('SPAPI_ENDPOINT', 'SPAPI_ENDPOINT_EU', 'SPAPI_ENDPOINT_FE'):
+        os.environ[variable] = server.url
+    os.environ['LWA_TOKEN_URL'] = f'{server.url}/auth/o2/token'
+    os.environ['ITEMS_PER_WORKER'] = str(args.items_per_worker)
+    os.environ['MAX_WORKERS'] = str(args.max_workers)
+    if args.feed_threshold is not None:
+        os.environ['FEED_THRESHOLD'] = str(args.feed_threshold)
+
+    import price_update_handler
+    import price_patcher
+    import spapi_client
+    import spapi_utils
+    from dynamo_utils import PENDING_INDEX_NAME
+
+    database = FakeDynamoDB(latency_ms=args.dynamodb_latency_ms)
+    table = database.create_table(TABLE_NAME, indexes={PENDING_INDEX_NAME: ('pending_bucket', 'last_updated_timestamp')})
+    database.create_table(price_update_handler.HISTORY_TABLE, hash_key='asin_marketplace', range_key='event_timestamp')
+
+    price_update_handler.dynamodb = database
+    price_patcher.dynamodb = database
+    price_patcher.lambda_client = FakeLambdaClient(price_patcher.lambda_handler, args.patcher_timeout)
+    spapi_client._clients = ThreadLocalClients()
+    spapi_utils.get_spapi_credentials = lambda: {
+        'lwa_app_id': 'bench', 'lwa_client_secret': 'bench', 'refresh_token': 'bench'
+    }
+    return server, database, table, price_update_handler, price_patcher
+
+
+def run_updates(args, database, handler_module):
+    """Replay notifications through the update handler and summarise throughput, latency and DynamoDB calls"""
+    products = replay.catalog(args.products, seed=args.seed, marketplace_ids=args.marketplaces)
+    if args.recorded:
+        events = replay.recorded_notifications(args.recorded)
+    else:
+        events = replay.synthetic_notifications(products, args.events, seed=args.seed)
+
+    latencies = []
+    event_count = 0
+    batch = []
+
+    def invoke_batch():
+        records = [{'messageId': str(i), 'body': json.dumps(event)} for i, event in enumerate(batch)]
+        started = time.perf_counter()
+        result = handler_module.batch_lambda_handler({'Records': records}, FakeContext(30))
+        latencies.append(time.perf_counter() - started)
+        if result['batchItemFailures']:
+            print(f"Batch reported {len(result['batchItemFailures'])} failures", file=sys.stderr)
+        batch.clear()
+
+    database.reset_calls()
+    started = time.perf_counter()
+    for event in replay.paced(events, args.rate):
+        event_count += 1
+        if args.mode == 'single':
+            call_started = time.perf_counter()
+            handler_module.lambda_handler(event, FakeContext(30))
+            latencies.append(time.perf_counter() - call_started)
+        else:
+            batch.append(event)
+            if len(batch) >= args.batch_size:
+                invoke_batch()
+    if batch:
+        invoke_batch()
+    elapsed = time.perf_counter() - started
+
+    return {
+        'events': event_count,
+        'invocations': len(latencies),
+        'elapsed_s': round(elapsed, 3),
+        'events_per_s': round(event_count / elapsed, 1) if elapsed else 0.0,
+        'latency_p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'latency_p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'latency_mean_ms': round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+        'dynamodb_calls': dict(database.calls),
+        'dynamodb_calls_per_event': round(sum(database.calls.values()) / event_count, 3) if event_count else 0.0
+    }
+
+
+def run_patcher(args, database, table, server, patcher_module):
+    """Run one patcher invocation over whatever the update phase left pending"""
+    pending_before = sum(1 for item in table.items.values() if 'pending_bucket' in item)
+
+    database.reset_calls()
+    server.counts.clear()
+    started = time.perf_counter()
+    result = patcher_module.lambda_handler({}, FakeContext(args.patcher_timeout))
+    patcher_module.lambda_client.join()
+    elapsed = time.perf_counter() - started
+
+    pending_after = sum(1 for item in table.items.values() if 'pending_bucket' in item)
+    dead = sum(1 for item in table.items.values() if item.get('patch_state') == 'DEAD')
+    retrying = sum(1 for item in table.items.values() if 'pending_bucket' in item and 'next_retry_at' in item)
+    committed = pending_before - pending_after - dead
+    requests = sum(server.counts[name] for name in ('patch', 'throttled'))
+
+    return {
+        'status_code': result['statusCode'],
+        'invocations': 1 + patcher_module.lambda_client.invocations,
+        'pending_before': pending_before,
+        'committed': committed,
+        'retry_scheduled': retrying,
+        'dead_lettered': dead,
+        'elapsed_s': round(elapsed, 3),
+        'patch_requests': requests,
+        'patch_requests_per_s': round(requests / elapsed, 1) if elapsed else 0.0,
+        'patches_per_s': round(committed / elapsed, 1) if elapsed else 0.0,
+        'success_rate': round(committed / pending_before, 4) if pending_before else 1.0,
+        'throttled_429': server.counts['throttled'],
+        'feeds_submitted': server.counts['createFeed'],
+        'token_requests': server.counts['token'],
+        'dynamodb_calls': dict(database.calls)
+    }
+
+
+def print_report(report):
+    updates, patcher = report['update_handler'], report['price_patcher']
+    print(f"price_update_handler ({report['config']['mode']} mode)")
+    print(f"  events                 {updates['events']} in {updates['invocations']} invocations, {updates['elapsed_s']} s")
+    print(f"  throughput             {updates['events_per_s']} events/s")
+    print(f"  latency p50 / p99      {updates['latency_p50_ms']} / {updates['latency_p99_ms']} ms per invocation")
+    print(f"  DynamoDB calls/event   {updates['dynamodb_calls_per_event']}  {updates['dynamodb_calls']}")
+    print('price_patcher')
+    print(f"  pending -> committed   {patcher['pending_before']} -> {patcher['committed']} in {patcher['elapsed_s']} s, {patcher['invocations']} invocations")
+    print(f"  PATCH requests/s       {patcher['patch_requests_per_s']} ({patcher['throttled_429']} throttled)")
+    print(f"  committed patches/s    {patcher['patches_per_s']}")
+    print(f"  retrying / dead        {patcher['retry_scheduled']} / {patcher['dead_lettered']}")
+    print(f"  success rate           {patcher['success_rate']:.2%}")
+    print(f"  feeds / token calls    {patcher['feeds_submitted']} / {patcher['token_requests']}")
+    print(f"  DynamoDB calls         {patcher['dynamodb_calls']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=2000, help='synthetic catalog size')
+    parser.add_argument('--events', type=int, default=5000, help='synthetic notifications to replay')
+    parser.add_argument('--rate', type=float, default=0, help='offered load in events/s (0 = as fast as possible)')
+    parser.add_argument('--recorded', help='JSON-lines file of recorded notifications to replay instead')
+    parser.add_argument('--mode', choices=('batch', 'single'), default='batch', help='update handler entry point')
+    parser.add_argument('--batch-size', type=int, default=100, help='SQS batch size in batch mode')
+    parser.add_argument('--dynamodb-latency-ms', type=float, default=0.0, help='added latency per DynamoDB call')
+    parser.add_argument('--spapi-latency-ms', type=float, default=50.0, help='added latency per SP-API call')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='fraction of SP-API calls answered with 429')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of patches rejected with 400')
+    parser.add_argument('--rate-limit', type=float, default=5.0, help='x-amzn-RateLimit-Limit sent by the fake')
+    parser.add_argument('--feed-threshold', type=int, help='override FEED_THRESHOLD for the patcher')
+    parser.add_argument('--patcher-timeout', type=float, default=300, help='patcher time budget in seconds')
+    parser.add_argument('--items-per-worker', type=int, default=2000, help='pending items per patcher worker invocation')
+    parser.add_argument('--max-workers', type=int, default=5, help='most patcher worker invocations per run')
+    parser.add_argument('--marketplaces', type=lambda value: value.split(','), default=[replay.MARKETPLACE_ID],
+                        help='comma-separated marketplace IDs to spread the catalog over')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--verbose', action='store_true', help='show the handlers\' own log lines')
+    args = parser.parse_args(argv)
+
+    server, database, table, handler_module, patcher_module = setup(args)
+    try:
+        for product in replay.catalog(args.products, seed=args.seed, marketplace_ids=args.marketplaces):
+            table.items[(product['asin'], product['marketplace_id'])] = to_dynamo(product)
+
+        handler_output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+        with handler_output:
+            report = {
+                'config': vars(args),
+                'update_handler': run_updates(args, database, handler_module),
+                'price_patcher': run_patcher(args, database, table, server, patcher_module)
+            }
+    finally:
+        server.stop()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    return report
+
+
+if __name__ == '__main__':
+    main()
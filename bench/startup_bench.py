@@ -0,0 +1,118 @@
+"""Cold-start benchmark for the Lambda handlers.
+
+Imports each handler module in fresh interpreters, the way a new Lambda
+container does, and reports the median import time, how much of it is the
+handler's own module-level init (clients, tables), the slowest third-party
+packages it imports directly, and which lambda/ modules were loaded. The
+last shows what each function's asset must ship.
+
+    python bench/startup_bench.py
+    python bench/startup_bench.py --runs 10 --json
+
+No AWS access is needed. The init-phase prewarm (secrets, LWA token) only
+runs inside Lambda, so it is not part of these numbers.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lambda')
+
+# Deployed functions per handler module
+HANDLER_MODULES = {
+    'price_update_handler': ['PriceUpdateHandler'],
+    'price_patcher': ['PricePatcherHandler', 'PriceStreamPatcherHandler']
+}
+
+LOCAL_MODULES = {name[:-3] for name in os.listdir(LAMBDA_DIR) if name.endswith('.py')}
+
+
+def parse_importtime(stderr):
+    """Parse `python -X importtime` output into (module, self_us, cumulative_us, depth) rows"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def measure(module):
+    """Import one handler module in a clean interpreter and break down where the time went"""
+    env = dict(os.environ, PYTHONPATH=LAMBDA_DIR, PYTHONDONTWRITEBYTECODE='1')
+    env.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    env.pop('AWS_LAMBDA_FUNCTION_NAME', None)
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        env=env, capture_output=True, text=True, check=True
+    )
+    rows = parse_importtime(result.stderr)
+
+    local = [row for row in rows if row[0] in LOCAL_MODULES]
+
+    # importtime lists children before their parent; the parent is the next row one level up
+    direct_imports = {}
+    for i, (name, _, cumulative_us, depth) in enumerate(rows):
+        parent = next((row[0] for row in rows[i + 1:] if row[3] == depth - 1), None)
+        root = name.split('.')[0]
+        if parent in LOCAL_MODULES and name not in LOCAL_MODULES and root not in sys.stdlib_module_names:
+            direct_imports[root] = direct_imports.get(root, 0) + cumulative_us
+
+    return {
+        'total_ms': next(row[2] for row in rows if row[0] == module) / 1000,
+        'init_ms': sum(row[1] for row in local) / 1000,
+        'imports': direct_imports,
+        'local_modules': sorted(row[0] for row in local)
+    }
+
+
+def benchmark(runs):
+    report = {}
+    for module, functions in HANDLER_MODULES.items():
+        samples = [measure(module) for _ in range(runs)]
+        imports = {}
+        for sample in samples:
+            for name, cumulative_us in sample['imports'].items():
+                imports.setdefault(name, []).append(cumulative_us / 1000)
+        report[module] = {
+            'functions': functions,
+            'import_ms_p50': round(statistics.median(sample['total_ms'] for sample in samples), 1),
+            'init_ms_p50': round(statistics.median(sample['init_ms'] for sample in samples), 1),
+            'slowest_imports_ms': dict(sorted(
+                ((name, round(statistics.median(values), 1)) for name, values in imports.items()),
+                key=lambda entry: entry[1], reverse=True
+            )[:5]),
+            'local_modules': samples[0]['local_modules']
+        }
+    return report
+
+
+def print_report(report):
+    for module, row in report.items():
+        print(f"{module} ({', '.join(row['functions'])})")
+        print(f"  import p50      {row['import_ms_p50']} ms, of which module-level init {row['init_ms_p50']} ms")
+        print(f"  slowest imports {', '.join(f'{name} {ms} ms' for name, ms in row['slowest_imports_ms'].items())}")
+        print(f"  ships           {', '.join(f'{name}.py' for name in row['local_modules'])}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per handler')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv)
+
+    report = benchmark(args.runs)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,24 @@
 import sys
 import json
+import time
+from functools import reduce
 import boto3
 import pymysql
 import logging
 from decimal import Decimal
+from urllib.parse import urlparse
 from awsglue.utils import getResolvedOptions
 from pyspark.context import SparkContext
 from awsglue.context import GlueContext
 from awsglue.job import Job
-from awsglue.dynamicframe import DynamicFrame
 from pyspark.sql import SparkSession
-from pyspark.sql.functions import lit
+from pyspark import StorageLevel
+from pyspark.sql.functions import lit, col, sha2, concat_ws
+from etl_common import (
+    get_db_connection, synced_update_kwargs, publish_constraints_version, resolve_write_capacity, paced_write,
+    parse_marketplace_ids, product_source, AdaptiveWriteRate, SYNCED_COLUMNS, KEY_COLUMNS,
+    DEFAULT_WRITE_CAPACITY_SHARE, DEFAULT_MARKETPLACE_ID
+)
 
 
 # Configure logging
@@ -22,27 +30,135 @@ handler.setFormatter(formatter)
 logger.addHandler(handler)
 
 
-def get_db_connection(credentials):
-    """Establish MySQL connection with timeout handling"""
+def get_optional_args(argv, defaults):
+    """Resolve optional Glue job arguments, falling back to defaults when not passed"""
+    present = [name for name in defaults if f"--{name}" in argv]
+    resolved = getResolvedOptions(argv, present) if present else {}
+    return {name: resolved.get(name, default) for name, default in defaults.items()}
+
+
+def split_s3_path(path):
+    parsed = urlparse(path)
+    return parsed.netloc, parsed.path.lstrip("/")
+
+
+def read_previous_snapshot(spark, state_path):
+    """Load the (asin, marketplace_id, content_hash) snapshot of the last successful run, or None"""
+    s3 = boto3.client("s3")
+    bucket, prefix = split_s3_path(state_path)
     try:
-        conn = pymysql.connect(
-            host=credentials["host"],
-            user=credentials["username"],
-            password=credentials["password"],
-            database=credentials.get("dbname", "terratree-production"),
-            connect_timeout=5,
-            read_timeout=30,
-            cursorclass=pymysql.cursors.SSDictCursor,
-        )
-        logger.info("Successfully connected to MySQL database")
-        return conn
-    except pymysql.Error as e:
-        logger.error(f"MySQL connection failed: {e}")
-        raise
+        marker = s3.get_object(Bucket=bucket, Key=f"{prefix.rstrip('/')}/_LATEST")
+    except s3.exceptions.NoSuchKey:
+        logger.info("No previous snapshot found; every row will be treated as new")
+        return None
+
+    run_id = marker["Body"].read().decode("utf-8").strip()
+    logger.info(f"Comparing against snapshot {run_id}")
+    return spark.read.parquet(f"{state_path.rstrip('/')}/{run_id}/")
+
+
+def write_snapshot(df, state_path, run_id):
+    """Persist this run's content hashes, then move the _LATEST marker to them"""
+    df.select(*KEY_COLUMNS, "content_hash").write.mode("overwrite").parquet(f"{state_path.rstrip('/')}/{run_id}/")
+
+    bucket, prefix = split_s3_path(state_path)
+    boto3.client("s3").put_object(Bucket=bucket, Key=f"{prefix.rstrip('/')}/_LATEST", Body=run_id.encode("utf-8"))
+    logger.info(f"Saved snapshot {run_id}")
+
+
+def get_partition_bounds(credentials, source_table, partition_column):
+    """Look up MIN/MAX of the numeric partition column so Spark can range-split the JDBC read"""
+    conn = get_db_connection(credentials)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"SELECT MIN({partition_column}) AS lower_bound, MAX({partition_column}) AS upper_bound "
+                f"FROM {source_table} WHERE product_id IS NOT NULL"
+            )
+            bounds = cursor.fetchone()
+            # Drain the streaming cursor before closing
+            cursor.fetchall()
+    finally:
+        conn.close()
+    return bounds["lower_bound"], bounds["upper_bound"]
+
+
+def read_products(spark, credentials, marketplace_id, partition_column, num_partitions, fetch_size):
+    """Read one marketplace's product/feed join over num_partitions parallel JDBC connections"""
+    source = product_source(marketplace_id)
+    lower_bound, upper_bound = get_partition_bounds(credentials, source["table"], partition_column)
+    if lower_bound is None:
+        lower_bound, upper_bound, num_partitions = 0, 0, 1
+    logger.info(
+        f"Reading {marketplace_id} {partition_column} range [{lower_bound}, {upper_bound}] "
+        f"in {num_partitions} partitions, fetch size {fetch_size}"
+    )
+
+    return spark.read \
+        .format("jdbc") \
+        .option("url", f"jdbc:mysql://{credentials['host']}:3306/{credentials.get('dbname', 'terratree-production')}") \
+        .option("user", credentials["username"]) \
+        .option("password", credentials["password"]) \
+        .option("dbtable", f"({source['query'].format(partition_column=partition_column)}) AS products") \
+        .option("partitionColumn", "partition_key") \
+        .option("lowerBound", str(lower_bound)) \
+        .option("upperBound", str(upper_bound)) \
+        .option("numPartitions", str(num_partitions)) \
+        .option("fetchsize", str(fetch_size)) \
+        .load() \
+        .drop("partition_key") \
+        .withColumn("marketplace_id", lit(marketplace_id))
+
+
+def compute_delta(df, previous):
+    """Tag rows that were inserted, changed or deleted since the previous snapshot"""
+    if previous is None:
+        return df.withColumn("change_type", lit("upsert"))
+
+    joined = df.join(previous.withColumnRenamed("content_hash", "previous_hash"), on=KEY_COLUMNS, how="full_outer")
+    upserts = joined.filter(
+        col("content_hash").isNotNull()
+        & (col("previous_hash").isNull() | (col("content_hash") != col("previous_hash")))
+    ).withColumn("change_type", lit("upsert"))
+    deletes = joined.filter(col("content_hash").isNull()).withColumn("change_type", lit("delete"))
+
+    return upserts.unionByName(deletes).drop("previous_hash")
+
+
+def write_delta_partition(rows, table_name, max_rate, counters):
+    """Apply one partition of changes with UpdateItem/DeleteItem, touching only the synced attributes
+
+    Writes are paced adaptively up to max_rate, this task's share of the load's write budget.
+    """
+    table = boto3.resource("dynamodb").Table(table_name)
+    pacer = AdaptiveWriteRate(max_rate)
+
+    for row in rows:
+        if row["change_type"] == "delete":
+            paced_write(pacer, table.delete_item, Key={"asin": row["asin"], "marketplace_id": row["marketplace_id"]})
+            counters["deleted"].add(1)
+        else:
+            paced_write(pacer, table.update_item, **synced_update_kwargs(row.asDict()))
+            counters["upserted"].add(1)
+    counters["throttles"].add(pacer.throttles)
 
 
 def main():
     args = getResolvedOptions(sys.argv, ["JOB_NAME", "DB_SECRET_ARN", "DYNAMODB_TABLE"])
+    options = get_optional_args(sys.argv, {
+        # full rewrites every row, delta only rows changed since STATE_PATH's snapshot;
+        # both update the synced attributes in place
+        "SYNC_MODE": "full",
+        "STATE_PATH": "",
+        "PARTITION_COLUMN": "id",
+        "NUM_PARTITIONS": "8",
+        "FETCH_SIZE": "5000",
+        "WRITE_CAPACITY_SHARE": str(DEFAULT_WRITE_CAPACITY_SHARE),
+        # 0 = read the table's provisioned or on-demand maximum write capacity
+        "WRITE_CAPACITY_UNITS": "0",
+        # Comma-separated; each marketplace is read from its own entry in PRODUCT_SOURCES
+        "MARKETPLACE_IDS": DEFAULT_MARKETPLACE_ID
+    })
     
     # Initialize Spark
     sc = SparkContext()
@@ -53,8 +169,15 @@ def main():
     
     db_secret_arn = args["DB_SECRET_ARN"]
     dynamodb_table = args["DYNAMODB_TABLE"]
+    sync_mode = options["SYNC_MODE"]
+    state_path = options["STATE_PATH"]
+    write_share = float(options["WRITE_CAPACITY_SHARE"])
+    marketplace_ids = parse_marketplace_ids(options["MARKETPLACE_IDS"])
 
-    logger.info("Starting ETL job")
+    if sync_mode == "delta" and not state_path:
+        raise ValueError("--STATE_PATH is required when --SYNC_MODE is delta")
+
+    logger.info(f"Starting ETL job in {sync_mode} mode")
     logger.info(f"Python version: {sys.version}")
     logger.info(f"PyMySQL version: {pymysql.__version__}")
     logger.info(f"Boto3 version: {boto3.__version__}")
@@ -70,49 +193,58 @@ def main():
         credentials = json.loads(secret["SecretString"])
         logger.info("Retrieved database credentials from Secrets Manager")
 
-        # Read data using Spark JDBC
-        df = spark.read \
-            .format("jdbc") \
-            .option("url", f"jdbc:mysql://{credentials['host']}:3306/{credentials.get('dbname', 'terratree-production')}") \
-            .option("user", credentials["username"]) \
-            .option("password", credentials["password"]) \
-            .option("query", """
-                SELECT
-                    t.product_id AS asin,
-                    COALESCE(t.retail_price, 0.0) AS retail_price,
-                    COALESCE(z.min_price, 0.0) AS min_price,
-                    COALESCE(z.max_price, 0.0) AS max_price,
-                    COALESCE(z.business_price, 0.0) AS business_price,
-                    COALESCE(z.sales_price, 0.0) AS currentPrice
-                FROM TerratreeProductsUSA t
-                LEFT JOIN ZoroFeedNew z
-                    ON LOWER(TRIM(t.seller_sku)) = LOWER(TRIM(z.sku))
-                WHERE t.product_id IS NOT NULL
-            """) \
-            .load()
-        
-        # Add marketplace_id column
-        df = df.withColumn("marketplace_id", lit("ATVPDKIKX0DER"))
+        # Read each marketplace's source using a partitioned Spark JDBC read, and keep the
+        # result so the MySQL joins run once per job
+        logger.info(f"Loading marketplaces {marketplace_ids}")
+        df = reduce(lambda left, right: left.unionByName(right), [
+            read_products(
+                spark,
+                credentials,
+                marketplace_id,
+                options["PARTITION_COLUMN"],
+                int(options["NUM_PARTITIONS"]),
+                int(options["FETCH_SIZE"])
+            )
+            for marketplace_id in marketplace_ids
+        ])
         
-        logger.info(f"Loaded {df.count()} records from database")
-        
-        # Convert to DynamicFrame and write to DynamoDB
-        dynf = DynamicFrame.fromDF(df, glueContext, "dframe")
+        # Both modes write only the synced attributes with UpdateItem, so the repricer's own
+        # attributes (updated_price, pending_bucket, retry state, competitor_summary) survive
+        df = df.withColumn(
+            "content_hash",
+            sha2(concat_ws("|", *[col(name).cast("string") for name in SYNCED_COLUMNS]), 256)
+        ).persist(StorageLevel.MEMORY_AND_DISK)
 
-        dynf.printSchema()
-        dynf.show()
-        
-        glueContext.write_dynamic_frame.from_options(
-            frame=dynf,
-            connection_type="dynamodb",
-            connection_options={
-                "dynamodb.output.tableName": dynamodb_table,
-                "dynamodb.throughput.write.percent": "1.0"
-            }
+        if sync_mode == "delta":
+            # Write only inserted, changed and deleted ASINs
+            changes = compute_delta(df, read_previous_snapshot(spark, state_path))
+        else:
+            # Rewrite every row; nothing is deleted
+            changes = df.withColumn("change_type", lit("upsert"))
+
+        # Every writer task gets an equal slice of the write budget; small budgets use
+        # fewer writers so each still gets about 1 write/s
+        capacity = int(options["WRITE_CAPACITY_UNITS"]) or resolve_write_capacity(dynamodb_table)
+        write_budget = capacity * write_share
+        writers = max(1, min(sc.defaultParallelism, int(write_budget)))
+        task_rate = write_budget / writers
+        changes = changes.coalesce(writers)
+        counters = {"upserted": sc.accumulator(0), "deleted": sc.accumulator(0), "throttles": sc.accumulator(0)}
+        changes.foreachPartition(lambda rows: write_delta_partition(rows, dynamodb_table, task_rate, counters))
+        logger.info(
+            f"{sync_mode.capitalize()} sync wrote {counters['upserted'].value} upserts and "
+            f"{counters['deleted'].value} deletes to DynamoDB "
+            f"({counters['throttles'].value} throttles, {task_rate:.2f} writes/s cap per task)"
         )
-        
-        logger.info("Successfully wrote all records to DynamoDB using Glue DynamicFrame")
 
+        run_id = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+        if counters["upserted"].value + counters["deleted"].value > 0:
+            publish_constraints_version(dynamodb_table, run_id)
+        # A full run also resets the baseline the next delta run compares against
+        if state_path:
+            write_snapshot(df, state_path, run_id)
+
+        df.unpersist()
         job.commit()
 
     except Exception as e:
@@ -0,0 +1,200 @@
+import logging
+import threading
+import time
+import boto3
+import pymysql
+from botocore.exceptions import ClientError
+from decimal import Decimal
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MARKETPLACE_ID = "ATVPDKIKX0DER"
+
+# Source-owned attributes; syncs hash and write only these, leaving the
+# repricer's own attributes (updated_price, competitor_summary, ...) alone
+SYNCED_COLUMNS = ["retail_price", "min_price", "max_price", "business_price", "currentPrice"]
+KEY_COLUMNS = ["asin", "marketplace_id"]
+
+# Share of the table's write capacity a load may use; the rest is headroom for
+# price_update_handler's live writes
+DEFAULT_WRITE_CAPACITY_SHARE = 0.5
+# Assumed capacity of an on-demand table with no max write throughput set
+# (what a new on-demand table can sustain without throttling)
+DEFAULT_ON_DEMAND_WRITE_UNITS = 4000
+
+THROTTLE_ERROR_CODES = {"ProvisionedThroughputExceededException", "ThrottlingException", "RequestLimitExceeded"}
+
+# Version stamp item read by price_update_handler's constraint cache; a new
+# constraints_version makes every container drop its cached min/max prices
+CONSTRAINTS_META_KEY = {"asin": "__meta__", "marketplace_id": "constraints"}
+
+PRODUCTS_QUERY = """
+    SELECT
+        t.{partition_column} AS partition_key,
+        t.product_id AS asin,
+        COALESCE(t.retail_price, 0.0) AS retail_price,
+        COALESCE(z.min_price, 0.0) AS min_price,
+        COALESCE(z.max_price, 0.0) AS max_price,
+        COALESCE(z.business_price, 0.0) AS business_price,
+        COALESCE(z.sales_price, 0.0) AS currentPrice
+    FROM TerratreeProductsUSA t
+    LEFT JOIN ZoroFeedNew z
+        ON LOWER(TRIM(t.seller_sku)) = LOWER(TRIM(z.sku))
+    WHERE t.product_id IS NOT NULL
+"""
+
+# Where each marketplace's products and price constraints come from; the source must be
+# priced in that marketplace's currency, since the repricer compares its featured prices
+# against them. Only the US catalog exists so far, so other marketplaces are refused.
+PRODUCT_SOURCES = {
+    DEFAULT_MARKETPLACE_ID: {"table": "TerratreeProductsUSA", "query": PRODUCTS_QUERY},
+}
+
+
+def get_db_connection(credentials):
+    """Establish MySQL connection with timeout handling"""
+    try:
+        conn = pymysql.connect(
+            host=credentials["host"],
+            user=credentials["username"],
+            password=credentials["password"],
+            database=credentials.get("dbname", "terratree-production"),
+            connect_timeout=5,
+            read_timeout=30,
+            cursorclass=pymysql.cursors.SSDictCursor,
+        )
+        logger.info("Successfully connected to MySQL database")
+        return conn
+    except pymysql.Error as e:
+        logger.error(f"MySQL connection failed: {e}")
+        raise
+
+
+def parse_marketplace_ids(value):
+    """Split a comma-separated marketplace ID list, dropping duplicates and refusing IDs without a product source"""
+    marketplace_ids = list(dict.fromkeys(part.strip() for part in (value or DEFAULT_MARKETPLACE_ID).split(",") if part.strip()))
+    unsupported = [marketplace_id for marketplace_id in marketplace_ids if marketplace_id not in PRODUCT_SOURCES]
+    if unsupported:
+        raise ValueError(
+            f"No product source in local currency for marketplaces {unsupported}; add one to PRODUCT_SOURCES "
+            f"instead of loading US prices into them"
+        )
+    return marketplace_ids
+
+
+def product_source(marketplace_id):
+    """The PRODUCT_SOURCES entry for one marketplace, refusing marketplaces without one"""
+    if marketplace_id not in PRODUCT_SOURCES:
+        raise ValueError(f"No product source in local currency for marketplace {marketplace_id}")
+    return PRODUCT_SOURCES[marketplace_id]
+
+
+def to_decimal(value):
+    """Convert a MySQL/Spark numeric (float, Decimal or None) to the Decimal DynamoDB expects"""
+    return Decimal(str(value if value is not None else 0.0))
+
+
+def synced_update_kwargs(row):
+    """UpdateItem arguments that set only the synced attributes of one product row"""
+    return {
+        "Key": {"asin": row["asin"], "marketplace_id": row["marketplace_id"]},
+        "UpdateExpression": "SET " + ", ".join(f"#{name} = :{name}" for name in SYNCED_COLUMNS),
+        "ExpressionAttributeNames": {f"#{name}": name for name in SYNCED_COLUMNS},
+        "ExpressionAttributeValues": {f":{name}": to_decimal(row[name]) for name in SYNCED_COLUMNS},
+    }
+
+
+def publish_constraints_version(table_name, version=None):
+    """Stamp a new constraints_version on the meta item after a load that changed synced attributes"""
+    version = version or time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+    boto3.resource("dynamodb").Table(table_name).update_item(
+        Key=CONSTRAINTS_META_KEY,
+        UpdateExpression="SET constraints_version = :v",
+        ExpressionAttributeValues={":v": version},
+    )
+    logger.info(f"Published constraints version {version}")
+    return version
+
+
+def resolve_write_capacity(table_name, default=DEFAULT_ON_DEMAND_WRITE_UNITS):
+    """Write units per second the table can take: provisioned WCU, the on-demand maximum, or a default"""
+    try:
+        table = boto3.client("dynamodb").describe_table(TableName=table_name)["Table"]
+    except ClientError as e:
+        logger.warning(f"Could not describe {table_name}, assuming {default} write units/s: {e}")
+        return default
+
+    provisioned = table.get("ProvisionedThroughput", {}).get("WriteCapacityUnits", 0)
+    if table.get("BillingModeSummary", {}).get("BillingMode") != "PAY_PER_REQUEST" and provisioned > 0:
+        return provisioned
+    on_demand_max = table.get("OnDemandThroughput", {}).get("MaxWriteRequestUnits", -1)
+    return on_demand_max if on_demand_max > 0 else default
+
+
+class AdaptiveWriteRate:
+    """Thread-safe AIMD pacer for ETL writes
+
+    Starts at half of max_rate, halves on throttling and adds `increase` writes/s for
+    every `idle_seconds` without a throttle, never exceeding max_rate, the load's
+    share of table capacity. Rates may be fractional (below 1 write/s) so a small
+    provisioned table split across many tasks still keeps its headroom.
+    """
+
+    def __init__(self, max_rate, min_rate=None, increase=None, idle_seconds=5.0):
+        if max_rate <= 0:
+            raise ValueError(f"max_rate must be positive, got {max_rate}")
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate) if min_rate is not None else max_rate / 20
+        self.rate = max(self.min_rate, self.max_rate / 2)
+        self.increase = increase or self.max_rate / 20
+        self.idle_seconds = idle_seconds
+        self.throttles = 0
+        self._lock = threading.Lock()
+        self._next_at = time.monotonic()
+        self._adjusted_at = self._next_at
+        self._backed_off_at = float("-inf")
+
+    def acquire(self):
+        """Block until the next write slot at the current rate"""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._adjusted_at >= self.idle_seconds and self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+                self._adjusted_at = now
+            wait = self._next_at - now
+            self._next_at = max(now, self._next_at) + 1.0 / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+    def throttled(self):
+        """Back off after a throttled write; concurrent throttles within one second count once"""
+        with self._lock:
+            self.throttles += 1
+            now = time.monotonic()
+            if now - self._backed_off_at >= 1.0:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self._backed_off_at = now
+                self._next_at = max(now, self._next_at) + 1.0 / self.rate
+            # Restart the idle clock so ramp-up waits for a quiet period
+            self._adjusted_at = now
+
+
+def paced_write(pacer, operation, max_attempts=8, **kwargs):
+    """Call a DynamoDB write (table.update_item, table.delete_item, ...) at the pacer's rate
+
+    A throttling error, or a success that botocore only reached after retrying,
+    slows the pacer down; throttled writes are retried up to max_attempts.
+    """
+    for attempt in range(1, max_attempts + 1):
+        pacer.acquire()
+        try:
+            response = operation(**kwargs)
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in THROTTLE_ERROR_CODES or attempt == max_attempts:
+                raise
+            pacer.throttled()
+            continue
+
+        if response.get("ResponseMetadata", {}).get("RetryAttempts", 0) > 0:
+            pacer.throttled()
+        return response
@@ -0,0 +1,163 @@
+"""Spark-free product sync: streams the product/feed join from MySQL straight into DynamoDB.
+
+Runs as a Lambda (stream_sync.lambda_handler) or locally:
+
+    python etl/stream_sync.py --secret-arn <DB_SECRET_ARN> --table terratree-products
+"""
+import argparse
+import concurrent.futures
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import boto3
+from etl_common import (
+    get_db_connection, synced_update_kwargs, publish_constraints_version, to_decimal, resolve_write_capacity,
+    paced_write, parse_marketplace_ids, product_source, AdaptiveWriteRate, SYNCED_COLUMNS, DEFAULT_MARKETPLACE_ID,
+    DEFAULT_WRITE_CAPACITY_SHARE
+)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+CHUNK_SIZE = int(os.environ.get("SYNC_CHUNK_SIZE", "500"))
+WRITER_THREADS = int(os.environ.get("SYNC_WRITER_THREADS", "8"))
+# Share of table write capacity the sync may use, and the capacity itself (0 = read it from the table)
+WRITE_CAPACITY_SHARE = float(os.environ.get("SYNC_WRITE_CAPACITY_SHARE", str(DEFAULT_WRITE_CAPACITY_SHARE)))
+WRITE_CAPACITY_UNITS = int(os.environ.get("SYNC_WRITE_CAPACITY_UNITS", "0"))
+
+_thread_state = threading.local()
+
+
+def _table(table_name):
+    """Per-thread Table resource, since boto3 resources are not thread-safe"""
+    if getattr(_thread_state, "table_name", None) != table_name:
+        _thread_state.table = boto3.session.Session().resource("dynamodb").Table(table_name)
+        _thread_state.table_name = table_name
+    return _thread_state.table
+
+
+def normalize_row(row, marketplace_id):
+    """Shape a streamed MySQL row like the Glue job's output: keys plus Decimal synced columns"""
+    normalized = {"asin": row["asin"], "marketplace_id": marketplace_id}
+    for name in SYNCED_COLUMNS:
+        normalized[name] = to_decimal(row[name])
+    return normalized
+
+
+def stream_chunks(conn, query, chunk_size):
+    """Yield lists of rows of a product source query from a server-side cursor without materialising the result"""
+    with conn.cursor() as cursor:
+        # The writers apply backpressure to this cursor; give the server time to wait for us
+        cursor.execute("SET SESSION net_write_timeout = 600")
+        # No range partitioning here; partition_key is just an unused extra column
+        cursor.execute(query.format(partition_column="product_id"))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield rows
+
+
+def write_chunk(table_name, rows, pacer):
+    """Apply one chunk of synced attributes with UpdateItem, leaving repricer state untouched"""
+    table = _table(table_name)
+    for row in rows:
+        paced_write(pacer, table.update_item, **synced_update_kwargs(row))
+    return len(rows)
+
+
+def sync_products(credentials, table_name, marketplace_ids=(DEFAULT_MARKETPLACE_ID,),
+                  chunk_size=CHUNK_SIZE, writer_threads=WRITER_THREADS,
+                  write_capacity_share=WRITE_CAPACITY_SHARE, write_capacity_units=WRITE_CAPACITY_UNITS):
+    """Stream every product row into DynamoDB through concurrent chunk writers with bounded read-ahead
+
+    Each marketplace is streamed from its own product source. All writers share one adaptive
+    pacer capped at write_capacity_share of the table's write capacity, so live
+    repricing keeps the rest.
+    """
+    sources = [(marketplace_id, product_source(marketplace_id)) for marketplace_id in marketplace_ids]
+    started = time.monotonic()
+    stats = {"rows": 0, "chunks": 0, "failed_chunks": 0}
+    capacity = write_capacity_units or resolve_write_capacity(table_name)
+    pacer = AdaptiveWriteRate(capacity * write_capacity_share)
+    stats_lock = threading.Lock()
+    # Chunks read ahead of the writers; caps memory at this many chunks of rows
+    inflight = threading.BoundedSemaphore(writer_threads * 2)
+
+    def on_done(future):
+        inflight.release()
+        error = future.exception()
+        with stats_lock:
+            if error is not None:
+                logger.error(f"Chunk write failed: {error}")
+                stats["failed_chunks"] += 1
+            else:
+                stats["rows"] += future.result()
+
+    conn = get_db_connection(credentials)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=writer_threads) as executor:
+            for marketplace_id, source in sources:
+                for rows in stream_chunks(conn, source["query"], chunk_size):
+                    inflight.acquire()
+                    chunk = [normalize_row(row, marketplace_id) for row in rows]
+                    executor.submit(write_chunk, table_name, chunk, pacer).add_done_callback(on_done)
+                    stats["chunks"] += 1
+    finally:
+        conn.close()
+
+    if stats["rows"] > 0:
+        publish_constraints_version(table_name)
+
+    stats["elapsed_seconds"] = round(time.monotonic() - started, 2)
+    stats["throttles"] = pacer.throttles
+    stats["final_write_rate"] = round(pacer.rate, 1)
+    logger.info(
+        f"Stream sync wrote {stats['rows']} rows in {stats['chunks']} chunks "
+        f"({stats['failed_chunks']} failed) in {stats['elapsed_seconds']}s, "
+        f"{stats['throttles']} throttles, ending at {stats['final_write_rate']} writes/s"
+    )
+    return stats
+
+
+def get_credentials(secret_arn):
+    secret = boto3.client("secretsmanager").get_secret_value(SecretId=secret_arn)
+    return json.loads(secret["SecretString"])
+
+
+def lambda_handler(event, context):
+    """Lambda entry point for intra-day syncs"""
+    stats = sync_products(
+        get_credentials(os.environ["DB_SECRET_ARN"]),
+        os.environ["DYNAMODB_TABLE"],
+        parse_marketplace_ids(os.environ.get("MARKETPLACE_IDS") or os.environ.get("MARKETPLACE_ID"))
+    )
+    status = 200 if stats["failed_chunks"] == 0 else 500
+    return {"statusCode": status, "body": json.dumps(stats)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream the product catalog from MySQL into DynamoDB")
+    parser.add_argument("--secret-arn", default=os.environ.get("DB_SECRET_ARN"), required="DB_SECRET_ARN" not in os.environ)
+    parser.add_argument("--table", default=os.environ.get("DYNAMODB_TABLE", "terratree-products"))
+    parser.add_argument("--marketplace-ids", type=parse_marketplace_ids, default=[DEFAULT_MARKETPLACE_ID],
+                        help="comma-separated marketplaces to sync, each from its own product source")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--writer-threads", type=int, default=WRITER_THREADS)
+    parser.add_argument("--write-capacity-share", type=float, default=WRITE_CAPACITY_SHARE)
+    parser.add_argument("--write-capacity-units", type=int, default=WRITE_CAPACITY_UNITS)
+    args = parser.parse_args()
+
+    logging.basicConfig(stream=sys.stdout, format="%(asctime)s - %(levelname)s - %(message)s")
+    stats = sync_products(
+        get_credentials(args.secret_arn), args.table, args.marketplace_ids, args.chunk_size, args.writer_threads,
+        args.write_capacity_share, args.write_capacity_units
+    )
+    sys.exit(0 if stats["failed_chunks"] == 0 else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+"""One-off migration: index items that were repriced before the pending-patch index existed.
+
+Items written by the old price_update_handler carry updated_price but no
+pending_bucket, so the patcher's index queries never see them. Run once after
+deploying the index:
+
+    python lambda/backfill_pending.py --table terratree-products
+"""
+import argparse
+import boto3
+from dynamo_utils import backfill_pending_buckets
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Add pending_bucket to items that still hold an unpatched updated_price')
+    parser.add_argument('--table', default='terratree-products')
+    args = parser.parse_args()
+
+    backfilled = backfill_pending_buckets(boto3.resource('dynamodb').Table(args.table))
+    print(f'Backfilled pending_bucket on {backfilled} items in {args.table}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import os
+import time
+from collections import OrderedDict
+from decimal import Decimal
+
+# The only attributes repricing reads from the product item
+CONSTRAINT_FIELDS = ('min_price', 'max_price', 'min_business_price', 'max_business_price')
+# Prices is_noop_update compares against, so a cache hit can still skip an unchanged write
+PRICE_FIELDS = ('updated_price', 'business_price', 'last_patched_price', 'last_patched_business_price')
+
+CONSTRAINT_CACHE_SIZE = int(os.environ.get('CONSTRAINT_CACHE_SIZE', '50000'))
+# Upper bound on staleness for changes made outside the ETL
+CONSTRAINT_CACHE_TTL_SECONDS = int(os.environ.get('CONSTRAINT_CACHE_TTL_SECONDS', '3600'))
+# How often a container re-reads the version stamp
+VERSION_CHECK_SECONDS = int(os.environ.get('CONSTRAINT_VERSION_CHECK_SECONDS', '60'))
+
+# Version stamp item the ETL jobs write after each load. Must match etl_common.CONSTRAINTS_META_KEY.
+CONSTRAINTS_META_KEY = {'asin': '__meta__', 'marketplace_id': 'constraints'}
+
+class ConstraintCache:
+    """Per-container LRU/TTL cache of min/max price constraints keyed by (asin, marketplace_id)
+
+    Entries also hold the prices the item had when read, updated with the prices this
+    container last wrote. Every entry is dropped when the ETL publishes a new
+    constraints_version on the meta item.
+    """
+
+    def __init__(self, max_size=CONSTRAINT_CACHE_SIZE, ttl_seconds=CONSTRAINT_CACHE_TTL_SECONDS,
+                 version_check_seconds=VERSION_CHECK_SECONDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.version_check_seconds = version_check_seconds
+        self.entries = OrderedDict()
+        self.version = None
+        self.checked_at = None
+        self.hits = 0
+        self.misses = 0
+
+    def check_version(self, table):
+        """Re-read the version stamp at most once per version_check_seconds, clearing the cache when it moved"""
+        now = time.monotonic()
+        if self.checked_at is not None and now - self.checked_at < self.version_check_seconds:
+            return
+        self.checked_at = now
+
+        try:
+            version = table.get_item(Key=CONSTRAINTS_META_KEY).get('Item', {}).get('constraints_version')
+        except Exception as e:
+            # Keep serving; entries still expire by TTL
+            print(f"Error reading constraints version: {str(e)}")
+            return
+
+        if version != self.version:
+            if self.entries:
+                print(f"Constraints version {self.version} -> {version}; dropping {len(self.entries)} cached entries")
+            self.entries.clear()
+            self.version = version
+
+    def get(self, key):
+        """Return cached constraints for a key, or None when absent or expired"""
+        entry = self.entries.get(key)
+        if entry is None or time.monotonic() >= entry[1]:
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, item):
+        """Cache the constraint and price fields of an item (empty for unknown ASINs) and return them"""
+        constraints = {name: item[name] for name in CONSTRAINT_FIELDS + PRICE_FIELDS if name in item}
+        self.entries[key] = (constraints, time.monotonic() + self.ttl_seconds)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return constraints
+
+    def record_write(self, key, new_price, business_price):
+        """Remember the prices this container just wrote for a cached key, as write_price_update stores them"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry[0]['updated_price'] = Decimal(str(round(new_price, 2)))
+            entry[0]['business_price'] = Decimal(str(round(business_price, 2)))
+
+_constraint_cache = ConstraintCache()
+
+def get_constraint_cache():
+    """Return the container-wide constraint cache"""
+    return _constraint_cache
@@ -1,9 +1,21 @@
 import json
 import os
+import time
 import boto3
 import pymysql
 from functools import lru_cache
 
+CONNECT_TIMEOUT_SECONDS = 5
+READ_TIMEOUT_SECONDS = 10
+WRITE_TIMEOUT_SECONDS = 10
+
+# Only ping a connection that has sat idle this long; a busy one is known to be alive
+PING_AFTER_IDLE_SECONDS = 30
+
+# One connection per Lambda container, reused across warm invocations
+_connection = None
+_last_used = 0.0
+
 @lru_cache(maxsize=1)
 def get_db_secrets():
     """Retrieve database secrets from AWS Secrets Manager"""
@@ -14,8 +26,8 @@ def get_db_secrets():
     
     return json.loads(response['SecretString'])
 
-def get_db_connection():
-    """Create database connection using secrets from Secrets Manager"""
+def _connect():
+    """Open a new connection using secrets from Secrets Manager"""
     secrets = get_db_secrets()
     
     return pymysql.connect(
@@ -24,5 +36,39 @@ def get_db_connection():
         user=secrets['username'],
         password=secrets['password'],
         port=secrets.get('port', 3306),
+        connect_timeout=CONNECT_TIMEOUT_SECONDS,
+        read_timeout=READ_TIMEOUT_SECONDS,
+        write_timeout=WRITE_TIMEOUT_SECONDS,
+        autocommit=True,
         cursorclass=pymysql.cursors.DictCursor
-    )
\ No newline at end of file
+    )
+
+def get_db_connection():
+    """Return the container's database connection, reconnecting when it has gone stale
+
+    The connection is shared across invocations, so callers must not close it.
+    """
+    global _connection, _last_used
+
+    if _connection is None or not _connection.open:
+        _connection = _connect()
+    elif time.monotonic() - _last_used > PING_AFTER_IDLE_SECONDS:
+        try:
+            _connection.ping(reconnect=True)
+        except pymysql.Error:
+            close_db_connection()
+            _connection = _connect()
+
+    _last_used = time.monotonic()
+    return _connection
+
+def close_db_connection():
+    """Close and forget the container's connection"""
+    global _connection
+
+    if _connection is not None:
+        try:
+            _connection.close()
+        except pymysql.Error:
+            pass
+        _connection = None
@@ -0,0 +1,332 @@
+import concurrent.futures
+import os
+import time
+import zlib
+from decimal import Decimal
+from boto3.dynamodb.conditions import Key, Attr
+from botocore.exceptions import ClientError
+
+# Sparse GSI over terratree-products: only items carrying `pending_bucket`
+# (set alongside `updated_price`, removed when the patch is committed) appear
+# in it, so reading it costs in proportion to the dirty items, not the catalog.
+# It projects only the attributes the patcher reads (see price-update-lambda-stack.ts);
+# an attribute the patcher starts reading must be added there too.
+PENDING_INDEX_NAME = os.environ.get('PENDING_INDEX_NAME', 'pending-patch-index')
+
+# Number of write shards for the index partition key. Must match between the
+# writer (price_update_handler) and the reader (price_patcher).
+PENDING_BUCKETS = int(os.environ.get('PENDING_BUCKETS', '10'))
+
+# Upper bound on concurrent write-back calls after a patch run
+COMMIT_CONCURRENCY = int(os.environ.get('COMMIT_CONCURRENCY', '16'))
+
+# Failed patches are retried with exponential backoff (next_retry_at, epoch seconds)
+# until MAX_PATCH_ATTEMPTS, then dead-lettered: patch_state = DEAD and out of the index
+MAX_PATCH_ATTEMPTS = int(os.environ.get('MAX_PATCH_ATTEMPTS', '8'))
+PATCH_RETRY_BASE_SECONDS = int(os.environ.get('PATCH_RETRY_BASE_SECONDS', '300'))
+PATCH_RETRY_MAX_SECONDS = 6 * 3600
+PATCH_STATE_DEAD = 'DEAD'
+
+
+def pending_bucket(asin):
+    """Map an ASIN to its shard of the pending-patch index"""
+    return zlib.crc32(asin.encode('utf-8')) % PENDING_BUCKETS
+
+
+def pending_query_kwargs(bucket, due_before=None, marketplace_id=None):
+    """Query arguments selecting one pending-patch shard, optionally only items due for a retry and one marketplace"""
+    query_kwargs = {
+        'IndexName': PENDING_INDEX_NAME,
+        'KeyConditionExpression': Key('pending_bucket').eq(bucket)
+    }
+
+    filters = []
+    if due_before is not None:
+        filters.append(Attr('next_retry_at').not_exists() | Attr('next_retry_at').lte(due_before))
+    if marketplace_id:
+        filters.append(Attr('marketplace_id').eq(marketplace_id))
+    if filters:
+        query_kwargs['FilterExpression'] = filters[0] if len(filters) == 1 else filters[0] & filters[1]
+    return query_kwargs
+
+
+def query_pending_bucket(table, bucket, due_before=None, marketplace_id=None):
+    """Query one pending-patch shard, following LastEvaluatedKey to the end"""
+    query_kwargs = pending_query_kwargs(bucket, due_before, marketplace_id)
+
+    items = []
+    while True:
+        response = table.query(**query_kwargs)
+        items.extend(response['Items'])
+
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            return items
+        query_kwargs['ExclusiveStartKey'] = last_key
+
+
+def count_pending_bucket(table, bucket, due_before=None, marketplace_id=None):
+    """Count one pending-patch shard's items with Select=COUNT, without reading them"""
+    query_kwargs = pending_query_kwargs(bucket, due_before, marketplace_id)
+    query_kwargs['Select'] = 'COUNT'
+
+    count = 0
+    while True:
+        response = table.query(**query_kwargs)
+        count += response['Count']
+
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            return count
+        query_kwargs['ExclusiveStartKey'] = last_key
+
+
+def query_pending_items(table, due_before=None, marketplace_id=None):
+    """Collect every pending item across all shards of the pending-patch index"""
+    items = []
+    for bucket in range(PENDING_BUCKETS):
+        items.extend(query_pending_bucket(table, bucket, due_before, marketplace_id))
+    return items
+
+
+def by_patch_priority(items):
+    """Order pending items for dispatch: highest patch_priority first, oldest reprice first among equals"""
+    return sorted(items, key=lambda item: (-item.get('patch_priority', 0), item.get('last_updated_timestamp', 0)))
+
+
+def backfill_pending_buckets(table):
+    """Put items repriced before the pending-patch index existed into it; returns the number backfilled
+
+    Scans for items holding updated_price without pending_bucket, skipping dead-lettered
+    ones, and sets pending_bucket unless the item was committed or indexed meanwhile.
+    """
+    scan_kwargs = {
+        'FilterExpression': Attr('updated_price').exists() & Attr('pending_bucket').not_exists() & Attr('patch_state').not_exists(),
+        'ProjectionExpression': 'asin, marketplace_id'
+    }
+
+    backfilled = 0
+    while True:
+        response = table.scan(**scan_kwargs)
+        for key in response['Items']:
+            try:
+                table.update_item(
+                    Key={'asin': key['asin'], 'marketplace_id': key['marketplace_id']},
+                    UpdateExpression='SET pending_bucket = :bucket',
+                    ConditionExpression='attribute_exists(updated_price) AND attribute_not_exists(pending_bucket)',
+                    ExpressionAttributeValues={':bucket': pending_bucket(key['asin'])}
+                )
+                backfilled += 1
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            return backfilled
+        scan_kwargs['ExclusiveStartKey'] = last_key
+
+
+def batch_get_items(table, keys, batch_size=100):
+    """Read items for (asin, marketplace_id) keys with BatchGetItem, retrying UnprocessedKeys
+
+    Returns a dict keyed by (asin, marketplace_id); keys with no item are absent.
+    """
+    items = {}
+    for start in range(0, len(keys), batch_size):
+        request_items = {
+            table.name: {
+                'Keys': [
+                    {'asin': asin, 'marketplace_id': marketplace_id}
+                    for asin, marketplace_id in keys[start:start + batch_size]
+                ]
+            }
+        }
+
+        attempt = 0
+        while request_items:
+            response = table.meta.client.batch_get_item(RequestItems=request_items)
+            for item in response['Responses'].get(table.name, []):
+                items[(item['asin'], item['marketplace_id'])] = item
+
+            request_items = response.get('UnprocessedKeys') or {}
+            if request_items:
+                attempt += 1
+                time.sleep(min(1.0, 0.05 * 2 ** attempt))
+
+    return items
+
+
+def batch_put_items(table, items, batch_size=25):
+    """Write items with BatchWriteItem, retrying UnprocessedItems with backoff"""
+    for start in range(0, len(items), batch_size):
+        request_items = {
+            table.name: [{'PutRequest': {'Item': item}} for item in items[start:start + batch_size]]
+        }
+
+        attempt = 0
+        while request_items:
+            response = table.meta.client.batch_write_item(RequestItems=request_items)
+
+            request_items = response.get('UnprocessedItems') or {}
+            if request_items:
+                attempt += 1
+                time.sleep(min(1.0, 0.05 * 2 ** attempt))
+
+
+def clear_patched_item(table, item):
+    """Clear the pending flags for one patched item unless it was repriced again since it was read
+
+    Records the pushed prices as last_patched_price/last_patched_business_price so
+    price_update_handler can recognise a repeat of them as a no-op, and drops the retry state.
+    Returns True when cleared, False when a newer reprice superseded the patch.
+    Uses the table's low-level client, which is safe to share across threads.
+    """
+    try:
+        table.meta.client.update_item(
+            TableName=table.name,
+            Key={'asin': item['asin'], 'marketplace_id': item['marketplace_id']},
+            UpdateExpression=(
+                'SET last_patched_price = :sent, last_patched_business_price = :bsent '
+                'REMOVE updated_price, pending_bucket, patch_attempts, next_retry_at, patch_priority'
+            ),
+            ConditionExpression='updated_price = :sent AND last_updated_timestamp = :ts',
+            ExpressionAttributeValues={
+                ':sent': item['updated_price'],
+                ':bsent': item.get('business_price', Decimal('0')),
+                ':ts': item['last_updated_timestamp']
+            }
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+
+
+def patch_retry_delay(attempts):
+    """Seconds to wait before retrying a patch that has failed `attempts` times"""
+    return min(PATCH_RETRY_MAX_SECONDS, PATCH_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+
+
+def record_patch_failure(table, item, now=None):
+    """Count one failed patch attempt: schedule the next retry, or dead-letter the item after MAX_PATCH_ATTEMPTS
+
+    Returns 'retry' or 'dead', or None when the item was repriced or committed since it was read.
+    """
+    now = int(now if now is not None else time.time())
+    attempts = int(item.get('patch_attempts', 0)) + 1
+    if attempts >= MAX_PATCH_ATTEMPTS:
+        outcome = 'dead'
+        update_expression = 'SET patch_attempts = :attempts, patch_state = :dead REMOVE pending_bucket, next_retry_at'
+        values = {':attempts': attempts, ':dead': PATCH_STATE_DEAD}
+    else:
+        outcome = 'retry'
+        update_expression = 'SET patch_attempts = :attempts, next_retry_at = :retry_at'
+        values = {':attempts': attempts, ':retry_at': now + patch_retry_delay(attempts)}
+
+    try:
+        table.meta.client.update_item(
+            TableName=table.name,
+            Key={'asin': item['asin'], 'marketplace_id': item['marketplace_id']},
+            UpdateExpression=update_expression,
+            ConditionExpression='attribute_exists(pending_bucket) AND last_updated_timestamp = :ts',
+            ExpressionAttributeValues={**values, ':ts': item['last_updated_timestamp']}
+        )
+        return outcome
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return None
+        raise
+
+
+def dead_letter_item(table, item):
+    """Take an item the patcher must not push out of the pending-patch index, as patch_state = DEAD
+
+    Returns True when dead-lettered, False when the item was repriced or committed since it was read.
+    """
+    try:
+        table.meta.client.update_item(
+            TableName=table.name,
+            Key={'asin': item['asin'], 'marketplace_id': item['marketplace_id']},
+            UpdateExpression='SET patch_state = :dead REMOVE pending_bucket, next_retry_at',
+            ConditionExpression='attribute_exists(pending_bucket) AND last_updated_timestamp = :ts',
+            ExpressionAttributeValues={':dead': PATCH_STATE_DEAD, ':ts': item['last_updated_timestamp']}
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+
+
+async def _update_items(update, table, items, concurrency):
+    """Run a per-item update on a bounded thread pool and return its results (or exceptions) in item order"""
+    # Imported here so the update handler, which never commits patches, does not load asyncio at cold start
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+
+    # The executor bounds in-flight calls; a slow write does not hold up the rest of its batch
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return await asyncio.gather(
+            *[loop.run_in_executor(executor, update, table, item) for item in items],
+            return_exceptions=True
+        )
+
+
+async def commit_patched_items(table, items, concurrency=COMMIT_CONCURRENCY):
+    """Clear pending flags for successfully patched items with bounded concurrency
+
+    Returns (cleared_asins, superseded_asins). Items whose clear failed for any
+    other reason are left pending and picked up by the next run.
+    """
+    cleared_asins = []
+    superseded_asins = []
+    results = await _update_items(clear_patched_item, table, items, concurrency)
+
+    for item, result in zip(items, results):
+        if isinstance(result, Exception):
+            print(f"Error clearing pending flag for ASIN {item['asin']}: {str(result)}")
+        elif result:
+            cleared_asins.append(item['asin'])
+        else:
+            superseded_asins.append(item['asin'])
+
+    return cleared_asins, superseded_asins
+
+
+async def record_patch_failures(table, items, concurrency=COMMIT_CONCURRENCY):
+    """Record a failed attempt for each item that could not be patched, with bounded concurrency
+
+    Returns (retry_asins, dead_asins). Items repriced since they were read are
+    skipped, since the new price starts a fresh set of attempts.
+    """
+    retry_asins = []
+    dead_asins = []
+    results = await _update_items(record_patch_failure, table, items, concurrency)
+
+    for item, result in zip(items, results):
+        if isinstance(result, Exception):
+            print(f"Error recording patch failure for ASIN {item['asin']}: {str(result)}")
+        elif result == 'dead':
+            print(f"Dead-lettered ASIN {item['asin']} after {MAX_PATCH_ATTEMPTS} failed patch attempts")
+            dead_asins.append(item['asin'])
+        elif result == 'retry':
+            retry_asins.append(item['asin'])
+
+    return retry_asins, dead_asins
+
+
+async def dead_letter_items(table, items, concurrency=COMMIT_CONCURRENCY):
+    """Dead-letter items that cannot be patched, with bounded concurrency; returns the dead-lettered ASINs"""
+    dead_asins = []
+    results = await _update_items(dead_letter_item, table, items, concurrency)
+
+    for item, result in zip(items, results):
+        if isinstance(result, Exception):
+            print(f"Error dead-lettering ASIN {item['asin']}: {str(result)}")
+        elif result:
+            dead_asins.append(item['asin'])
+
+    return dead_asins
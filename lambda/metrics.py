@@ -0,0 +1,86 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'TerratreeRepricer')
+
+# CloudWatch accepts at most this many values per metric in one EMF document
+MAX_VALUES_PER_DOCUMENT = 100
+
+class Metrics:
+    """Per-invocation timers, counters and value distributions, flushed as CloudWatch Embedded Metric Format
+
+    Recording is a dict lookup and a list append; everything is serialised once,
+    in flush(), as JSON lines on stdout that CloudWatch Logs turns into metrics.
+    """
+
+    def __init__(self, service, namespace=METRICS_NAMESPACE):
+        self.namespace = namespace
+        self.dimensions = {'Service': service}
+        self.properties = {}
+        self.values = {}
+        self.units = {}
+
+    def put(self, name, value, unit='None'):
+        """Record one observation of a metric; repeated observations form a distribution"""
+        self.values.setdefault(name, []).append(value)
+        self.units[name] = unit
+
+    def count(self, name, value=1):
+        """Add to a counter, which is emitted as a single summed value"""
+        if name in self.values:
+            self.values[name][0] += value
+        else:
+            self.values[name] = [value]
+            self.units[name] = 'Count'
+
+    def set_property(self, name, value):
+        """Attach a searchable log field that is not a metric, e.g. a request id"""
+        self.properties[name] = value
+
+    @contextmanager
+    def timer(self, name):
+        """Record the wall time of the block in milliseconds"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.put(name, elapsed_ms(started), 'Milliseconds')
+
+    def flush(self):
+        """Print the recorded metrics as EMF documents and reset"""
+        if not self.values:
+            return
+
+        timestamp = int(time.time() * 1000)
+        longest = max(len(values) for values in self.values.values())
+        for offset in range(0, longest, MAX_VALUES_PER_DOCUMENT):
+            chunk = {
+                name: values[offset:offset + MAX_VALUES_PER_DOCUMENT]
+                for name, values in self.values.items()
+                if len(values) > offset
+            }
+            document = {
+                '_aws': {
+                    'Timestamp': timestamp,
+                    'CloudWatchMetrics': [{
+                        'Namespace': self.namespace,
+                        'Dimensions': [list(self.dimensions)],
+                        'Metrics': [{'Name': name, 'Unit': self.units[name]} for name in chunk]
+                    }]
+                },
+                **self.dimensions,
+                **self.properties
+            }
+            for name, values in chunk.items():
+                values = [round(value, 3) for value in values]
+                document[name] = values[0] if len(values) == 1 else values
+            print(json.dumps(document))
+
+        self.values = {}
+        self.units = {}
+
+def elapsed_ms(started):
+    """Milliseconds since a time.perf_counter() reading"""
+    return (time.perf_counter() - started) * 1000
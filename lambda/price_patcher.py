@@ -1,14 +1,63 @@
 import json
 import os
 import boto3
-import urllib3
 import asyncio
-import concurrent.futures
+import gzip
+import math
 import time
 from decimal import Decimal
-from spapi_utils import get_spapi_credentials
+from boto3.dynamodb.types import TypeDeserializer
+from spapi_utils import get_token_provider, get_spapi_credentials, get_marketplace_ids, marketplaces_by_region, marketplace_region, marketplace_currency, DEFAULT_REGION
+from spapi_client import get_spapi_client, deadline_from_context
+from dynamo_utils import query_pending_bucket, count_pending_bucket, commit_patched_items, record_patch_failures, dead_letter_items, by_patch_priority, PENDING_BUCKETS
+from metrics import Metrics, elapsed_ms
 
 dynamodb = boto3.resource('dynamodb')
+# Created on first fan-out; the stream entry point never needs it
+lambda_client = None
+
+# Batches at least this large are submitted as one JSON_LISTINGS_FEED instead of per-ASIN PATCHes
+FEED_THRESHOLD = int(os.environ.get('FEED_THRESHOLD', '500'))
+SELLER_ID = os.environ.get('SELLER_ID', 'AERPN1UM8O1I4')
+FEED_POLL_SECONDS = 15
+# How long to wait for feed processing when running without a Lambda deadline
+FEED_MAX_WAIT_SECONDS = 240
+
+# A scheduled run fans out to one worker per ITEMS_PER_WORKER pending items, up to MAX_WORKERS
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', '5'))
+ITEMS_PER_WORKER = int(os.environ.get('ITEMS_PER_WORKER', '2000'))
+# Self re-invocations allowed per shard before leftovers wait for the next scheduled run
+MAX_CONTINUATIONS = int(os.environ.get('MAX_CONTINUATIONS', '8'))
+# Time kept back to commit the last chunk and invoke the continuation
+CHECKPOINT_RESERVE_SECONDS = 30
+# Largest PATCH chunk committed at once; smaller when less time is left
+PATCH_CHUNK_SIZE = 200
+# A feed is only submitted with time for it to finish processing
+MIN_FEED_SECONDS = 180
+
+# Prices this container already pushed, by (asin, marketplace_id), so a redelivered
+# stream record is committed without a second PATCH
+RECENT_PATCH_LIMIT = 10000
+_recent_patches = {}
+
+deserializer = TypeDeserializer()
+
+def prewarm():
+    """Load SP-API secrets, each region's LWA token and client during the init phase, before the first event"""
+    try:
+        get_spapi_credentials()
+        for region in marketplaces_by_region(get_marketplace_ids()):
+            get_token_provider(region).prime()
+            get_spapi_client(region)
+    except Exception as e:
+        print(f"Prewarm failed, continuing lazily: {str(e)}")
+
+def get_lambda_client():
+    """Return the container's Lambda client for self-invocations, creating it on first use"""
+    global lambda_client
+    if lambda_client is None:
+        lambda_client = boto3.client('lambda')
+    return lambda_client
 
 def lambda_handler(event, context):
     return asyncio.run(async_lambda_handler(event, context))
@@ -16,113 +65,399 @@ def lambda_handler(event, context):
 async def async_lambda_handler(event, context):
     """
     Lambda function to poll SP-API hourly for pricing data
+    
+    The scheduled run splits the pending buckets into shards and invokes a worker
+    per extra shard. A worker that runs short of time re-invokes itself with its
+    shard; the pending index is the checkpoint, since committed items leave it.
+    Items are patched highest patch_priority first; failed ones wait out their
+    next_retry_at, so they are not retried within the same run. Each SP-API
+    region runs as its own concurrent pipeline over its marketplaces.
     """
     
     table_name = os.environ['DYNAMODB_TABLE']
-    marketplace_id = os.environ['MARKETPLACE_ID']
+    marketplace_ids = get_marketplace_ids()
+    regions = marketplaces_by_region(marketplace_ids)
     
     table = dynamodb.Table(table_name)
+    metrics = Metrics('price_patcher')
+    metrics.set_property('MarketplaceIds', marketplace_ids)
+    
+    # Worker and continuation invocations carry their shard; the scheduled event does not
+    buckets = event.get('buckets') if isinstance(event, dict) else None
+    continuation = event.get('continuation', 0) if buckets is not None else 0
+    workers = event.get('workers', 1) if buckets is not None else 1
     
     try:
-        # Get access token
-        access_token = get_access_token()
-        if not access_token:
+        # Get an access token per region; a region without one waits for the next run
+        with metrics.timer('TokenFetchTime'):
+            access_tokens = await get_access_tokens(regions)
+        if not access_tokens:
             return {
                 'statusCode': 500,
                 'body': json.dumps('Failed to get access token')
             }
         
-        # Scan DynamoDB for items updated in the last hour
-        from boto3.dynamodb.conditions import Attr
+        if buckets is None:
+            # Plan over every pending item due for a (re)try and hand out all but the first shard
+            due_before = int(time.time())
+            with metrics.timer('PlanTime'):
+                shards = plan_shards(table, due_before)
+            workers = max(1, len(shards))
+            buckets = shards[0] if shards else []
+            for shard in shards[1:]:
+                if not invoke_self(context, {'buckets': shard, 'due_before': due_before, 'workers': workers, 'continuation': 0}):
+                    buckets = buckets + shard
+            metrics.count('WorkersInvoked', len(shards) - 1 if shards else 0)
+        else:
+            due_before = event['due_before']
         
-        one_hour_ago = int(time.time()) - 3600
+        metrics.set_property('Buckets', buckets)
+        metrics.set_property('Continuation', continuation)
         
-        response = table.scan(
-            FilterExpression=Attr('updated_price').exists() & Attr('last_updated_timestamp').gte(one_hour_ago)
-        )
+        # SP-API quotas are per seller and region, so concurrent workers split each region's evenly
+        for region in access_tokens:
+            get_spapi_client(region).set_rate_share(1.0 / workers)
         
-        # Prepare batch requests for patchListingsItem
-        batch_requests = []
-        for item in response['Items']:
-            asin = item['asin']
-            updated_price = float(item.get('updated_price', 0))
-            business_price = float(item.get('business_price', 0))
-            
-            if updated_price > 0:
-                batch_requests.append({
-                    'uri': f'/listings/2021-08-01/items/{asin}',
-                    'method': 'PATCH',
-                    'body': create_patch_payload(updated_price, business_price, marketplace_id)
-                })
-        
-        # Send parallel PATCH requests
-        updated_count = 0
-        if batch_requests:
-            success_asins = await send_parallel_patch_requests(response['Items'], access_token, marketplace_id)
-            updated_count = len(success_asins)
-            
-            # Remove updated_price flag for successfully updated items
-            for asin in success_asins:
-                table.update_item(
-                    Key={'asin': asin, 'marketplace_id': marketplace_id},
-                    UpdateExpression='REMOVE updated_price'
+        with metrics.timer('PendingQueryTime'):
+            pending_items = []
+            for bucket in buckets:
+                pending_items.extend(query_pending_bucket(table, bucket, due_before))
+        
+        # When the rate limit runs out the budget, it goes to the biggest price moves and lost featured offers.
+        # Items this deployment must not push leave the index instead of being re-read every run.
+        patchable_items = by_patch_priority(item for item in pending_items if is_patchable(item, marketplace_ids))
+        unpatchable_items = [item for item in pending_items if not is_patchable(item, marketplace_ids)]
+        metrics.count('PendingItems', len(pending_items))
+        metrics.count('PatchableItems', len(patchable_items))
+        if unpatchable_items:
+            dead_asins = await dead_letter_items(table, unpatchable_items)
+            metrics.count('UnpatchableItems', len(dead_asins))
+            print(f"Dead-lettered {len(dead_asins)} items in unconfigured marketplaces or without min_price")
+        
+        # Regional pipelines run concurrently, so wall time follows the slowest region rather than the sum
+        with metrics.timer('PatchPhaseTime'):
+            results = await asyncio.gather(*[
+                patch_region(
+                    table,
+                    {marketplace_id: [item for item in patchable_items if item['marketplace_id'] == marketplace_id]
+                     for marketplace_id in region_marketplaces},
+                    access_tokens[region], context, metrics
                 )
+                for region, region_marketplaces in regions.items() if region in access_tokens
+            ])
+        updated_count = sum(count for count, _ in results)
+        finished = all(region_finished for _, region_finished in results)
+        
+        if not finished:
+            checkpoint(context, buckets, due_before, workers, continuation, metrics)
+        
+        for region in access_tokens:
+            token_provider = get_token_provider(region)
+            print(f"LWA token cache ({region}): {token_provider.hits} hits, {token_provider.refreshes} refreshes")
         
         return {
             'statusCode': 200,
             'body': json.dumps({
-                'message': 'Price updates completed',
-                'updated_count': updated_count
+                'message': 'Price updates completed' if finished else 'Price updates checkpointed',
+                'updated_count': updated_count,
+                'buckets': buckets,
+                'continuation': continuation
             })
         }
         
     except Exception as e:
         print(f"Error in price patching: {str(e)}")
+        metrics.count('Errors')
         return {
             'statusCode': 500,
             'body': json.dumps(f'Error: {str(e)}')
         }
+    
+    finally:
+        metrics.flush()
+
+def is_patchable(item, marketplace_ids):
+    """True for a pending item with a positive price, in a patched marketplace, priced against ETL constraints
+
+    An item without min_price was repriced with no floor or ceiling, so its price is not pushed.
+    """
+    return (
+        float(item.get('updated_price', 0)) > 0
+        and item['marketplace_id'] in marketplace_ids
+        and 'min_price' in item
+    )
+
+def seconds_left(context):
+    """Seconds until the Lambda times out, or unlimited outside Lambda"""
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return float('inf')
+    return context.get_remaining_time_in_millis() / 1000.0
+
+def plan_shards(table, due_before):
+    """Split the non-empty pending buckets into up to MAX_WORKERS shards of similar size
+    
+    Uses one worker per ITEMS_PER_WORKER pending items, so small backlogs stay in a single invocation.
+    """
+    counts = {bucket: count_pending_bucket(table, bucket, due_before) for bucket in range(PENDING_BUCKETS)}
+    busy_buckets = sorted((bucket for bucket in counts if counts[bucket]), key=counts.get, reverse=True)
+    if not busy_buckets:
+        return []
+    
+    total = sum(counts.values())
+    worker_count = min(MAX_WORKERS, len(busy_buckets), max(1, math.ceil(total / ITEMS_PER_WORKER)))
+    
+    # Largest bucket first onto the least-loaded shard
+    shards = [[] for _ in range(worker_count)]
+    loads = [0] * worker_count
+    for bucket in busy_buckets:
+        i = loads.index(min(loads))
+        shards[i].append(bucket)
+        loads[i] += counts[bucket]
+    
+    print(f"Planned {total} pending items across {worker_count} shard(s): {loads}")
+    return shards
 
-def get_access_token():
-    """Generate SP-API access token using LWA credentials"""
+def invoke_self(context, payload):
+    """Start an asynchronous invocation of this function for a shard; returns False if it could not be queued"""
     try:
-        spapi_creds = get_spapi_credentials()
-        
-        token_url = "https://api.amazon.com/auth/o2/token"
-        payload = {
-            'grant_type': 'refresh_token',
-            'refresh_token': spapi_creds['refresh_token'],
-            'client_id': spapi_creds['lwa_app_id'],
-            'client_secret': spapi_creds['lwa_client_secret']
-        }
-        
-        import urllib.parse
-        http = urllib3.PoolManager()
-        encoded_data = urllib.parse.urlencode(payload)
-        response = http.request(
-            'POST',
-            token_url,
-            body=encoded_data,
-            headers={'Content-Type': 'application/x-www-form-urlencoded'}
+        get_lambda_client().invoke(
+            FunctionName=context.invoked_function_arn,
+            InvocationType='Event',
+            Payload=json.dumps(payload).encode('utf-8')
         )
-        if response.status == 200:
-            token_data = json.loads(response.data.decode('utf-8'))
-            return token_data.get('access_token')
+        return True
+    except Exception as e:
+        print(f"Error invoking worker for buckets {payload['buckets']}: {str(e)}")
+        return False
+
+def checkpoint(context, buckets, due_before, workers, continuation, metrics):
+    """Hand an unfinished shard to a fresh invocation, up to MAX_CONTINUATIONS times"""
+    if continuation >= MAX_CONTINUATIONS:
+        print(f"Buckets {buckets} unfinished after {continuation} continuations; leaving them for the next run")
+        return
+    
+    if invoke_self(context, {'buckets': buckets, 'due_before': due_before, 'workers': workers, 'continuation': continuation + 1}):
+        metrics.count('Continuations')
+        print(f"Checkpointed buckets {buckets}; continuation {continuation + 1} invoked")
+
+async def commit_successes(table, patched_items, metrics):
+    """Clear updated_price (and the index entry) for the patched items, unless repriced meanwhile"""
+    with metrics.timer('CommitTime'):
+        cleared_asins, superseded_asins = await commit_patched_items(table, patched_items)
+    metrics.count('CommittedItems', len(cleared_asins))
+    metrics.count('SupersededItems', len(superseded_asins))
+    print(f"Committed {len(cleared_asins)} patched items, {len(superseded_asins)} superseded by newer reprices")
+    return len(patched_items)
+
+async def record_failures(table, failed_items, metrics):
+    """Schedule a backed-off retry for each item that failed to patch, dead-lettering those out of attempts"""
+    if not failed_items:
+        return
+    with metrics.timer('FailureRecordTime'):
+        retry_asins, dead_asins = await record_patch_failures(table, failed_items)
+    metrics.count('RetryScheduledItems', len(retry_asins))
+    metrics.count('DeadLetteredItems', len(dead_asins))
+    print(f"Scheduled retries for {len(retry_asins)} failed items, dead-lettered {len(dead_asins)}")
+
+async def patch_region(table, items_by_marketplace, access_token, context, metrics):
+    """Patch one region's marketplaces in turn, each by PATCH requests or a single listings feed for large batches
+    
+    Marketplaces in a region share its rate limits, so running them concurrently would not go faster.
+    Returns (patched_count, finished); finished is False when time ran out first.
+    """
+    patched_count = 0
+    for marketplace_id, items in items_by_marketplace.items():
+        if not items:
+            continue
+        if len(items) >= FEED_THRESHOLD:
+            count, finished = await patch_by_feed(table, items, access_token, marketplace_id, context, metrics)
         else:
-            print(f"Token refresh failed: {response.status} - {response.data.decode('utf-8')}")
-            return None
+            count, finished = await patch_in_chunks(table, items, access_token, marketplace_id, context, metrics)
+        patched_count += count
+        if not finished:
+            return patched_count, False
+    
+    return patched_count, True
+
+async def patch_in_chunks(table, items, access_token, marketplace_id, context, metrics):
+    """PATCH and commit items in chunks sized to the time left, so finished work is kept
+    
+    Returns (patched_count, finished); finished is False when time ran out first.
+    """
+    limiter = get_spapi_client(marketplace_region(marketplace_id)).limiter('patchListingsItem')
+    patched_count = 0
+    start = 0
+    while start < len(items):
+        # As many PATCHes as the rate limit allows before the checkpoint reserve; full chunks outside Lambda
+        time_left = seconds_left(context)
+        if math.isinf(time_left):
+            chunk_size = PATCH_CHUNK_SIZE
+        else:
+            chunk_size = min(PATCH_CHUNK_SIZE, int(limiter.rate * (time_left - CHECKPOINT_RESERVE_SECONDS)))
+        if chunk_size < 1:
+            return patched_count, False
+        
+        chunk = items[start:start + chunk_size]
+        deadline = deadline_from_context(context, CHECKPOINT_RESERVE_SECONDS)
+        success_asins = set(await send_parallel_patch_requests(chunk, access_token, marketplace_id, deadline, metrics))
+        patched_count += await commit_successes(table, [item for item in chunk if item['asin'] in success_asins], metrics)
+        await record_failures(table, [item for item in chunk if item['asin'] not in success_asins], metrics)
+        start += chunk_size
+    
+    return patched_count, True
+
+async def patch_by_feed(table, items, access_token, marketplace_id, context, metrics):
+    """Submit items as one feed if there is time for it to be processed, then commit the accepted ones"""
+    if seconds_left(context) < MIN_FEED_SECONDS + CHECKPOINT_RESERVE_SECONDS:
+        return 0, False
+    
+    deadline = deadline_from_context(context, CHECKPOINT_RESERVE_SECONDS)
+    success_asins, rejected_asins = await submit_patch_feed(items, access_token, marketplace_id, deadline, metrics)
+    success_asins, rejected_asins = set(success_asins), set(rejected_asins)
+    patched_count = await commit_successes(table, [item for item in items if item['asin'] in success_asins], metrics)
+    # Only listings the report rejected count as attempts; a feed that never reached DONE leaves items untouched
+    await record_failures(table, [item for item in items if item['asin'] in rejected_asins], metrics)
+    return patched_count, True
+
+def stream_lambda_handler(event, context):
+    return asyncio.run(async_stream_handler(event, context))
+
+async def async_stream_handler(event, context):
+    """
+    Lambda function to patch repriced items within seconds, from the table's DynamoDB stream
+    
+    The event source's batching window is the per-ASIN debounce: every reprice of an
+    ASIN inside one batch collapses into a single PATCH of the newest price. Items
+    that fail get a backed-off retry time and stay pending for the hourly sweeper.
+    Errors outside single PATCHes (token fetch, commit) are raised, so the event
+    source retries the batch.
+    """
+    
+    table = dynamodb.Table(os.environ['DYNAMODB_TABLE'])
+    deadline = deadline_from_context(context)
+    metrics = Metrics('price_stream_patcher')
+    
+    records = event.get('Records', [])
+    latest = {}
+    for record in records:
+        images = record.get('dynamodb', {})
+        new_image = images.get('NewImage')
+        if not new_image or 'updated_price' not in new_image:
+            continue
+        
+        # Only reprices move last_updated_timestamp; source syncs of a pending item do not
+        if images.get('OldImage', {}).get('last_updated_timestamp') == new_image.get('last_updated_timestamp'):
+            continue
+        
+        item = {name: deserializer.deserialize(value) for name, value in new_image.items()}
+        key = (item['asin'], item['marketplace_id'])
+        if key not in latest or item['last_updated_timestamp'] >= latest[key]['last_updated_timestamp']:
+            latest[key] = item
+    
+    metrics.count('StreamRecords', len(records))
+    metrics.count('CoalescedItems', len(latest))
+    
+    try:
+        marketplace_ids = get_marketplace_ids()
+        to_patch = []
+        already_patched = []
+        for key, item in latest.items():
+            if _recent_patches.get(key) == patched_version(item):
+                already_patched.append(item)
+            elif is_patchable(item, marketplace_ids):
+                to_patch.append(item)
+        metrics.count('RedeliveredItems', len(already_patched))
+        
+        patched_items = list(already_patched)
+        failed_items = []
+        if to_patch:
+            marketplaces = {}
+            for item in to_patch:
+                marketplaces.setdefault(item['marketplace_id'], []).append(item)
+            
+            with metrics.timer('TokenFetchTime'):
+                access_tokens = await get_access_tokens(marketplaces_by_region(marketplaces))
+            if not access_tokens:
+                raise RuntimeError('Failed to get access token')
+            # Marketplaces whose region has no token stay pending for the sweeper
+            marketplaces = {
+                marketplace_id: items for marketplace_id, items in marketplaces.items()
+                if marketplace_region(marketplace_id) in access_tokens
+            }
+            
+            with metrics.timer('PatchPhaseTime'):
+                results = await asyncio.gather(*[
+                    send_parallel_patch_requests(
+                        items, access_tokens[marketplace_region(marketplace_id)], marketplace_id, deadline, metrics
+                    )
+                    for marketplace_id, items in marketplaces.items()
+                ])
+            
+            for items, success_asins in zip(marketplaces.values(), results):
+                succeeded = set(success_asins)
+                for item in items:
+                    if item['asin'] in succeeded:
+                        remember_patch(item)
+                        patched_items.append(item)
+                    else:
+                        failed_items.append(item)
+        
+        await commit_successes(table, patched_items, metrics)
+        await record_failures(table, failed_items, metrics)
+        
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'message': 'Stream batch patched',
+                'records': len(records),
+                'patched_count': len(patched_items)
+            })
+        }
+    
     except Exception as e:
-        print(f"Error getting access token: {str(e)}")
+        print(f"Error in stream patching: {str(e)}")
+        metrics.count('Errors')
+        # Fail the invocation so the event source retries and bisects the batch; a returned 500 would count as success
+        raise
+    
+    finally:
+        metrics.flush()
+
+def patched_version(item):
+    """The prices and reprice time that identify one patch of an item"""
+    return (item.get('updated_price'), item.get('business_price'), item.get('last_updated_timestamp'))
+
+def remember_patch(item):
+    """Record a pushed price for this container, forgetting the oldest entries past RECENT_PATCH_LIMIT"""
+    key = (item['asin'], item['marketplace_id'])
+    _recent_patches.pop(key, None)
+    _recent_patches[key] = patched_version(item)
+    while len(_recent_patches) > RECENT_PATCH_LIMIT:
+        del _recent_patches[next(iter(_recent_patches))]
+
+async def get_access_token(region=DEFAULT_REGION):
+    """Get a region's SP-API access token from the container-wide LWA token cache"""
+    try:
+        return await get_token_provider(region).get_token()
+    except Exception as e:
+        print(f"Error getting access token for region {region}: {str(e)}")
         return None
 
-def create_patch_payload(regular_price, business_price, marketplace_id):
-    """Create patch payload for patchListingsItem"""
+async def get_access_tokens(regions):
+    """Fetch access tokens for several regions concurrently; regions that failed are left out"""
+    regions = list(regions)
+    tokens = await asyncio.gather(*[get_access_token(region) for region in regions])
+    return {region: token for region, token in zip(regions, tokens) if token}
+
+def create_patch_payload(regular_price, business_price, marketplace_id, currency=None):
+    """Create patch payload for patchListingsItem, priced in the marketplace's currency unless one is given"""
+    currency = currency or marketplace_currency(marketplace_id)
     quantity_discounts = [
-        {'quantityTier': 5, 'quantityDiscountType': 'QUANTITY_DISCOUNT', 'listingPrice': {'amount': round(business_price * 0.99, 2), 'currencyCode': 'USD'}},
-        {'quantityTier': 10, 'quantityDiscountType': 'QUANTITY_DISCOUNT', 'listingPrice': {'amount': round(business_price * 0.98, 2), 'currencyCode': 'USD'}},
-        {'quantityTier': 25, 'quantityDiscountType': 'QUANTITY_DISCOUNT', 'listingPrice': {'amount': round(business_price * 0.97, 2), 'currencyCode': 'USD'}},
-        {'quantityTier': 50, 'quantityDiscountType': 'QUANTITY_DISCOUNT', 'listingPrice': {'amount': round(business_price * 0.96, 2), 'currencyCode': 'USD'}},
-        {'quantityTier': 100, 'quantityDiscountType': 'QUANTITY_DISCOUNT', 'listingPrice': {'amount': round(business_price * 0.95, 2), 'currencyCode': 'USD'}}
+        {'quantityTier': 5, 'quantityDiscountType': 'QUANTITY_DISCOUNT', 'listingPrice': {'amount': round(business_price * 0.99, 2), 'currencyCode': currency}},
+        {'quantityTier': 10, 'quantityDiscountType': 'QUANTITY_DISCOUNT', 'listingPrice': {'amount': round(business_price * 0.98, 2), 'currencyCode': currency}},
+        {'quantityTier': 25, 'quantityDiscountType': 'QUANTITY_DISCOUNT', 'listingPrice': {'amount': round(business_price * 0.97, 2), 'currencyCode': currency}},
+        {'quantityTier': 50, 'quantityDiscountType': 'QUANTITY_DISCOUNT', 'listingPrice': {'amount': round(business_price * 0.96, 2), 'currencyCode': currency}},
+        {'quantityTier': 100, 'quantityDiscountType': 'QUANTITY_DISCOUNT', 'listingPrice': {'amount': round(business_price * 0.95, 2), 'currencyCode': currency}}
     ]
     
     return {
@@ -133,7 +468,7 @@ def create_patch_payload(regular_price, business_price, marketplace_id):
                 'path': '/attributes/purchasable_offer',
                 'value': [{
                     'marketplace_id': marketplace_id,
-                    'currency': 'USD',
+                    'currency': currency,
                     'our_price': [{'schedule': [{'value_with_tax': regular_price}]}]
                 }]
             },
@@ -143,7 +478,7 @@ def create_patch_payload(regular_price, business_price, marketplace_id):
                 'value': [{
                     'marketplace_id': marketplace_id,
                     'value_with_tax': business_price,
-                    'currency': 'USD'
+                    'currency': currency
                 }]
             },
             {
@@ -154,59 +489,217 @@ def create_patch_payload(regular_price, business_price, marketplace_id):
         ]
     }
 
-def patch_single_item(asin, regular_price, business_price, marketplace_id, access_token):
-    """Send single PATCH request for one item"""
-    headers = {
-        'x-amz-access-token': access_token,
-        'Content-Type': 'application/json'
-    }
-    
-    payload = create_patch_payload(regular_price, business_price, marketplace_id)
+async def patch_single_item(asin, regular_price, business_price, marketplace_id, access_token, client=None, deadline=None, payload=None, metrics=None):
+    """Send single PATCH request for one item through the marketplace region's shared SP-API client"""
+    client = client or get_spapi_client(marketplace_region(marketplace_id))
+    payload = payload or create_patch_payload(regular_price, business_price, marketplace_id)
     
     try:
-        http = urllib3.PoolManager()
-        response = http.request(
+        started = time.perf_counter()
+        response = await client.request(
             'PATCH',
-            f'https://sellingpartnerapi-na.amazon.com/listings/2021-08-01/items/{asin}?marketplaceIds={marketplace_id}',
-            headers=headers,
-            body=json.dumps(payload)
+            f'/listings/2021-08-01/items/{asin}?marketplaceIds={marketplace_id}',
+            access_token,
+            body=payload,
+            deadline=deadline
         )
         
+        # Latency includes rate-limiter waits and retries, i.e. what the item actually cost
+        if metrics is not None:
+            metrics.put('PatchLatency', elapsed_ms(started), 'Milliseconds')
+            metrics.count('PatchRetries', response.attempts - 1)
+            metrics.count('PatchThrottles', response.throttles)
+        
         if response.status == 200:
             print(f"Successfully updated ASIN {asin}")
             return asin
         else:
-            print(f"Failed to update ASIN {asin}: {response.status}")
+            print(f"Failed to update ASIN {asin}: {response.status} after {response.attempts} attempt(s), {response.throttles} throttled")
             return None
             
     except Exception as e:
         print(f"Error updating ASIN {asin}: {str(e)}")
+        if metrics is not None:
+            metrics.count('PatchErrors')
         return None
 
-async def send_parallel_patch_requests(items, access_token, marketplace_id):
-    """Send parallel PATCH requests using ThreadPoolExecutor"""
-    loop = asyncio.get_event_loop()
+async def send_parallel_patch_requests(items, access_token, marketplace_id, deadline=None, metrics=None):
+    """Send parallel PATCH requests, paced by the marketplace region's rate limiter"""
+    client = get_spapi_client(marketplace_region(marketplace_id))
+    metrics = metrics or Metrics('price_patcher')
     
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        tasks = []
+    # Build every payload up front so build time is measured apart from request latency
+    with metrics.timer('PayloadBuildTime'):
+        patches = []
         for item in items:
-            asin = item['asin']
             updated_price = float(item.get('updated_price', 0))
             business_price = float(item.get('business_price', 0))
             
             if updated_price > 0:
-                task = loop.run_in_executor(
-                    executor, 
-                    patch_single_item, 
-                    asin, updated_price, business_price, marketplace_id, access_token
-                )
-                tasks.append(task)
+                payload = create_patch_payload(updated_price, business_price, marketplace_id)
+                patches.append((item['asin'], updated_price, business_price, payload))
+    
+    tasks = [
+        patch_single_item(
+            asin, updated_price, business_price, marketplace_id, access_token,
+            client=client, deadline=deadline, payload=payload, metrics=metrics
+        )
+        for asin, updated_price, business_price, payload in patches
+    ]
+    
+    print(f"Sending {len(tasks)} parallel PATCH requests")
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    
+    # Filter successful results
+    success_asins = [asin for asin in results if asin and not isinstance(asin, Exception)]
+    metrics.count('PatchSucceeded', len(success_asins))
+    metrics.count('PatchFailed', len(tasks) - len(success_asins))
+    print(f"Parallel update completed: {len(success_asins)}/{len(tasks)} successful")
+    
+    return success_asins
+
+def create_feed_document(items, marketplace_id, seller_id=SELLER_ID):
+    """Pack the patches for pending items into a JSON_LISTINGS_FEED document
+
+    Returns (document, message_items) where message_items maps messageId to the item it patches.
+    """
+    messages = []
+    message_items = {}
+    for item in items:
+        updated_price = float(item.get('updated_price', 0))
+        business_price = float(item.get('business_price', 0))
+        
+        if updated_price > 0:
+            payload = create_patch_payload(updated_price, business_price, marketplace_id)
+            message_id = len(messages) + 1
+            messages.append({
+                'messageId': message_id,
+                'sku': item['asin'],
+                'operationType': 'PATCH',
+                'productType': payload['productType'],
+                'patches': payload['patches']
+            })
+            message_items[message_id] = item
+    
+    document = {
+        'header': {'sellerId': seller_id, 'version': '2.0', 'issueLocale': 'en_US'},
+        'messages': messages
+    }
+    return document, message_items
+
+def reconcile_processing_report(report, message_items):
+    """Split the feed's ASINs into (accepted, rejected): rejected ones have an ERROR issue in the processing report"""
+    failed_ids = set()
+    for issue in report.get('issues', []):
+        if issue.get('severity') != 'ERROR':
+            continue
+        failed_ids.add(issue.get('messageId'))
+        if issue.get('messageId') in message_items:
+            print(f"Feed rejected ASIN {message_items[issue['messageId']]['asin']}: {issue.get('code')} - {issue.get('message')}")
+    
+    accepted = [item['asin'] for message_id, item in message_items.items() if message_id not in failed_ids]
+    rejected = [item['asin'] for message_id, item in message_items.items() if message_id in failed_ids]
+    return accepted, rejected
+
+async def submit_patch_feed(items, access_token, marketplace_id, deadline=None, metrics=None):
+    """Submit pending patches as one JSON_LISTINGS_FEED and return (accepted_asins, rejected_asins)
+
+    Items are only reported either way once the feed is DONE and its processing
+    report has been reconciled; otherwise both lists are empty and the items stay
+    pending for the next run.
+    """
+    client = get_spapi_client(marketplace_region(marketplace_id))
+    metrics = metrics or Metrics('price_patcher')
+    with metrics.timer('PayloadBuildTime'):
+        document, message_items = create_feed_document(items, marketplace_id)
+    content_type = 'application/json; charset=UTF-8'
+    
+    print(f"Submitting {len(message_items)} patches as a JSON_LISTINGS_FEED")
+    
+    try:
+        # Create and upload the feed document
+        response = await client.request(
+            'POST', '/feeds/2021-06-30/documents', access_token,
+            body={'contentType': content_type}, deadline=deadline, operation='createFeedDocument'
+        )
+        if response.status not in (200, 201):
+            print(f"createFeedDocument failed: {response.status}")
+            return [], []
+        feed_document = response.json()
+        
+        upload = await client.transfer(
+            'PUT', feed_document['url'],
+            body=json.dumps(document).encode('utf-8'), headers={'Content-Type': content_type}
+        )
+        if upload.status != 200:
+            print(f"Feed document upload failed: {upload.status}")
+            return [], []
+        
+        # Submit the feed
+        response = await client.request(
+            'POST', '/feeds/2021-06-30/feeds', access_token,
+            body={
+                'feedType': 'JSON_LISTINGS_FEED',
+                'marketplaceIds': [marketplace_id],
+                'inputFeedDocumentId': feed_document['feedDocumentId']
+            },
+            deadline=deadline, operation='createFeed'
+        )
+        if response.status not in (200, 202):
+            print(f"createFeed failed: {response.status}")
+            return [], []
+        feed_id = response.json()['feedId']
+        print(f"Submitted feed {feed_id}")
         
-        print(f"Sending {len(tasks)} parallel PATCH requests")
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        # Wait for processing to finish
+        wait_started = time.perf_counter()
+        wait_until = deadline if deadline is not None else time.monotonic() + FEED_MAX_WAIT_SECONDS
+        while True:
+            response = await client.request(
+                'GET', f'/feeds/2021-06-30/feeds/{feed_id}', access_token,
+                deadline=deadline, operation='getFeed'
+            )
+            feed = response.json() if response.status == 200 else {}
+            status = feed.get('processingStatus')
+            if status in ('DONE', 'CANCELLED', 'FATAL'):
+                break
+            if time.monotonic() + FEED_POLL_SECONDS >= wait_until:
+                print(f"Feed {feed_id} still {status} at deadline; items stay pending")
+                return [], []
+            await asyncio.sleep(FEED_POLL_SECONDS)
         
-        # Filter successful results
-        success_asins = [asin for asin in results if asin and not isinstance(asin, Exception)]
-        print(f"Parallel update completed: {len(success_asins)}/{len(tasks)} successful")
+        metrics.put('FeedProcessingTime', elapsed_ms(wait_started), 'Milliseconds')
         
-        return success_asins
\ No newline at end of file
+        if status != 'DONE' or not feed.get('resultFeedDocumentId'):
+            print(f"Feed {feed_id} finished with status {status}")
+            return [], []
+        
+        # Download and reconcile the processing report
+        response = await client.request(
+            'GET', f"/feeds/2021-06-30/documents/{feed['resultFeedDocumentId']}", access_token,
+            deadline=deadline, operation='getFeedDocument'
+        )
+        if response.status != 200:
+            print(f"getFeedDocument failed: {response.status}")
+            return [], []
+        result_document = response.json()
+        
+        download = await client.transfer('GET', result_document['url'])
+        report_data = download.data
+        if result_document.get('compressionAlgorithm') == 'GZIP':
+            report_data = gzip.decompress(report_data)
+        report = json.loads(report_data.decode('utf-8'))
+        
+        success_asins, rejected_asins = reconcile_processing_report(report, message_items)
+        metrics.count('PatchSucceeded', len(success_asins))
+        metrics.count('PatchFailed', len(rejected_asins))
+        print(f"Feed {feed_id} completed: {len(success_asins)}/{len(message_items)} accepted")
+        return success_asins, rejected_asins
+        
+    except Exception as e:
+        print(f"Error submitting listings feed: {str(e)}")
+        return [], []
+
+# Only inside Lambda: locally (bench, tests) the fakes are wired in after import
+if 'AWS_LAMBDA_FUNCTION_NAME' in os.environ:
+    prewarm()
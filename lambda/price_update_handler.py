@@ -1,11 +1,44 @@
 import json
 import os
 import boto3
+import concurrent.futures
 import time
+import zlib
+from datetime import datetime, timezone
 from decimal import Decimal
+from botocore.exceptions import ClientError
+from dynamo_utils import pending_bucket, batch_get_items, batch_put_items
+from repricing import find_featured_offer, reprice_item, reprice_batch, constraint_arrays, REPRICED, OUR_SELLER_ID
+from metrics import Metrics
+from constraint_cache import get_constraint_cache
 
 dynamodb = boto3.resource('dynamodb')
 
+# Concurrent DynamoDB writes per SQS batch
+BATCH_WRITE_CONCURRENCY = int(os.environ.get('BATCH_WRITE_CONCURRENCY', '10'))
+
+# Full competitor snapshots go to a separate table as compressed blobs, expiring after
+# HISTORY_TTL_DAYS; the product item keeps only competitor_summary. Empty disables history.
+HISTORY_TABLE = os.environ.get('HISTORY_TABLE', 'terratree-competitor-history')
+HISTORY_TTL_DAYS = int(os.environ.get('HISTORY_TTL_DAYS', '30'))
+
+# Added to a reprice's patch_priority, in currency units, when our live offer has lost
+# the featured offer; the rest is the size of the price move
+FEATURED_LOSS_WEIGHT = float(os.environ.get('FEATURED_LOSS_WEIGHT', '10'))
+
+# Marketplaces this deployment reprices, as the patcher's MARKETPLACE_IDS; notifications for
+# others are ignored so they never enter the pending-patch index
+MARKETPLACE_IDS = set(
+    part.strip() for part in (os.environ.get('MARKETPLACE_IDS') or os.environ.get('MARKETPLACE_ID', 'ATVPDKIKX0DER')).split(',')
+    if part.strip()
+)
+
+def prewarm():
+    """Build the Table resource classes during the init phase so the first event does not pay for it"""
+    dynamodb.Table(os.environ.get('DYNAMODB_TABLE', 'terratree-products'))
+    if HISTORY_TABLE:
+        dynamodb.Table(HISTORY_TABLE)
+
 def lambda_handler(event, context):
     """
     Lambda function to handle Amazon SP-API price change events
@@ -16,140 +49,121 @@ def lambda_handler(event, context):
     markup_percentage = float(os.environ.get('MARKUP_PERCENTAGE', '15'))
     
     table = dynamodb.Table(table_name)
+    metrics = Metrics('price_update_handler')
     
     try:
         # Parse SP-API notification
-        payload = event.get('Payload', {})
-        notification = payload.get('AnyOfferChangedNotification', {})
-        event_time = event.get('EventTime')
-        
-        # Extract ASIN and marketplace from OfferChangeTrigger
-        trigger = notification.get('OfferChangeTrigger', {})
-        asin = trigger.get('ASIN')
-        marketplace_id = trigger.get('MarketplaceId')
+        notification = parse_notification(event)
         
-        if not asin or not marketplace_id:
+        if not notification:
+            metrics.count('InvalidEvents')
             return {
                 'statusCode': 400,
                 'body': json.dumps('Missing ASIN or MarketplaceId')
             }
         
-        # Get offers and summary data
-        offers = notification.get('Offers', [])
-        summary = notification.get('Summary', {})
-        lowest_prices = summary.get('LowestPrices', [])
+        asin = notification['asin']
+        marketplace_id = notification['marketplace_id']
         
-        if not offers:
+        if marketplace_id not in MARKETPLACE_IDS:
+            metrics.count('UnconfiguredMarketplace')
+            return {
+                'statusCode': 200,
+                'body': json.dumps(f'Marketplace {marketplace_id} is not repriced by this deployment')
+            }
+        
+        if not notification['offers']:
+            metrics.count('NoOffers')
             return {
                 'statusCode': 200,
                 'body': json.dumps('No offers found in event')
             }
         
-        # Check if we are already the featured offer
-        our_seller_id = 'AERPN1UM8O1I4'
-        featured_offer_price = None
-        we_are_featured = False
-        
-        # Find the featured offer (lowest price)
-        for price_info in lowest_prices:
-            if price_info.get('Condition') == 'new':
-                listing_price = price_info.get('ListingPrice', {})
-                amount = listing_price.get('Amount')
-                if amount:
-                    featured_offer_price = amount
-                    break
-        
-        # Check if we are the featured seller
-        for offer in offers:
-            if offer.get('SellerId') == our_seller_id:
-                offer_price = offer.get('ListingPrice', {}).get('Amount')
-                if offer_price and offer_price == featured_offer_price:
-                    we_are_featured = True
-                    break
+        featured_offer_price, we_are_featured = find_featured_offer(notification['lowest_prices'], notification['offers'])
         
         if we_are_featured:
+            metrics.count('AlreadyFeatured')
             return {
                 'statusCode': 200,
                 'body': json.dumps('We are already the featured offer - no repricing needed')
             }
         
         if featured_offer_price is None:
+            metrics.count('NoPrice')
             return {
                 'statusCode': 200,
                 'body': json.dumps('No valid pricing found')
             }
         
-        # Get existing item to check min/max prices
-        existing_item = table.get_item(
-            Key={'asin': asin, 'marketplace_id': marketplace_id}
-        ).get('Item', {})
+        # Get min/max prices, from the container cache for repeat ASINs
+        with metrics.timer('ItemReadTime'):
+            existing_item, cached = get_constraints(table, asin, marketplace_id)
+        metrics.count('ConstraintCacheHits' if cached else 'ConstraintCacheMisses')
         
-        min_price = float(existing_item.get('min_price', 0))
+        # Without a min_price from the ETL the floor would be 0 and the ceiling unbounded
+        if 'min_price' not in existing_item:
+            metrics.count('NoConstraints')
+            return {
+                'statusCode': 200,
+                'body': json.dumps({
+                    'message': 'No repricing - no min/max constraints loaded for this listing',
+                    'asin': asin,
+                    'marketplace_id': marketplace_id
+                })
+            }
         
-        # Set new price to 1 cent below featured offer
-        new_price = featured_offer_price - 0.01
+        prices = reprice_item(featured_offer_price, existing_item)
         
         # Only reprice if new price is above our minimum price
-        if new_price <= min_price:
+        if prices is None:
+            metrics.count('BelowMinimum')
+            min_price = float(existing_item.get('min_price', 0))
             return {
                 'statusCode': 200,
                 'body': json.dumps({
                     'message': 'No repricing needed - would be at or below minimum',
                     'featured_price': featured_offer_price,
-                    'target_price': new_price,
+                    'target_price': featured_offer_price - 0.01,
                     'min_price': min_price
                 })
             }
         
-        max_price = float(existing_item.get('max_price', float('inf')))
-        
-        # Apply max constraint
-        if new_price > max_price:
-            new_price = max_price
-        
-        # Calculate business price (1 cent below regular price)
-        business_price = new_price - 0.01
-        min_business_price = float(existing_item.get('min_business_price', 0))
-        max_business_price = float(existing_item.get('max_business_price', float('inf')))
-        
-        if business_price < min_business_price:
-            business_price = min_business_price
-        elif business_price > max_business_price:
-            business_price = max_business_price
-        
-        # Store competitor offers
-        competitor_offers = []
-        for offer in offers:
-            listing_price = offer.get('ListingPrice', {})
-            if listing_price.get('Amount'):
-                competitor_offers.append({
-                    'seller_id': offer.get('SellerId'),
-                    'price': Decimal(str(listing_price['Amount'])),
-                    'currency': listing_price.get('CurrencyCode', 'USD'),
-                    'condition': offer.get('SubCondition'),
-                    'is_fba': offer.get('IsFulfilledByAmazon', False)
+        new_price, business_price = prices
+        
+        # Skip the write when the price we already hold (pending or last patched) is unchanged;
+        # a cache hit compares against the prices this container last read or wrote
+        if is_noop_update(existing_item, new_price, business_price):
+            metrics.count('Unchanged')
+            return {
+                'statusCode': 200,
+                'body': json.dumps({
+                    'message': 'No repricing needed - price unchanged',
+                    'asin': asin,
+                    'new_price': round(new_price, 2)
                 })
+            }
         
-        # Update DynamoDB with new prices and competitor data
-        response = table.update_item(
-            Key={
-                'asin': asin,
-                'marketplace_id': marketplace_id
-            },
-            UpdateExpression='SET updated_price = :price, business_price = :bprice, last_updated = :timestamp, last_updated_timestamp = :ts, competitor_offers = :offers',
-            ExpressionAttributeValues={
-                ':price': Decimal(str(round(new_price, 2))),
-                ':bprice': Decimal(str(round(business_price, 2))),
-                ':timestamp': context.aws_request_id,
-                ':ts': int(time.mktime(time.strptime(event_time, '%Y-%m-%dT%H:%M:%S.%fZ'))),
-                ':offers': competitor_offers
-            },
-            ReturnValues='UPDATED_NEW'
-        )
+        # Update DynamoDB with new prices and competitor summary, unless a newer event got there first
+        with metrics.timer('WriteTime'):
+            written = write_price_update(table, notification, new_price, business_price, context.aws_request_id)
+        if not written:
+            metrics.count('SkippedWrites')
+            return {
+                'statusCode': 200,
+                'body': json.dumps({
+                    'message': 'Skipped write - item already updated from a newer event or price unchanged',
+                    'asin': asin,
+                    'event_time': notification['event_time']
+                })
+            }
         
-
+        get_constraint_cache().record_write((asin, marketplace_id), new_price, business_price)
+        
+        with metrics.timer('HistoryWriteTime'):
+            write_competitor_history(notification)
         
         # Price update will be handled by hourly poller
+        metrics.count('Repriced')
         
         return {
             'statusCode': 200,
@@ -161,10 +175,324 @@ def lambda_handler(event, context):
                 'business_price': round(business_price, 2)
             })
         }
-        
+    
     except Exception as e:
         print(f"Error processing price update: {str(e)}")
+        metrics.count('Errors')
         return {
             'statusCode': 500,
             'body': json.dumps(f'Error: {str(e)}')
-        }
\ No newline at end of file
+        }
+    
+    finally:
+        metrics.flush()
+
+def batch_lambda_handler(event, context):
+    """
+    Lambda function to handle a batch of SP-API price change events delivered
+    through SQS, coalescing them to the newest event per ASIN and marketplace
+    """
+    
+    table_name = os.environ['DYNAMODB_TABLE']
+    table = dynamodb.Table(table_name)
+    metrics = Metrics('price_update_batch_handler')
+    
+    records = event.get('Records', [])
+    failed_message_ids = []
+    
+    # Keep only the newest notification per (asin, marketplace_id); older ones
+    # would be overwritten anyway, but succeed or fail together with the newest
+    latest = {}
+    unconfigured = 0
+    for record in records:
+        message_id = record['messageId']
+        try:
+            notification = parse_notification(json.loads(record['body']))
+        except Exception as e:
+            print(f"Error parsing message {message_id}: {str(e)}")
+            failed_message_ids.append(message_id)
+            continue
+        
+        if not notification or not notification['offers']:
+            continue
+        if notification['marketplace_id'] not in MARKETPLACE_IDS:
+            unconfigured += 1
+            continue
+        
+        key = (notification['asin'], notification['marketplace_id'])
+        entry = latest.setdefault(key, {'notification': notification, 'message_ids': []})
+        entry['message_ids'].append(message_id)
+        if notification['timestamp'] >= entry['notification']['timestamp']:
+            entry['notification'] = notification
+    
+    # Reprice the coalesced batch in one pass, reading constraints only for ASINs not cached
+    keys = list(latest.keys())
+    cache = get_constraint_cache()
+    try:
+        with metrics.timer('ItemReadTime'):
+            cache.check_version(table)
+            existing_items = {key: cache.get(key) for key in keys}
+            missing_keys = [key for key, item in existing_items.items() if item is None]
+            fetched_items = batch_get_items(table, missing_keys) if missing_keys else {}
+            for key in missing_keys:
+                existing_items[key] = fetched_items.get(key, {})
+                cache.put(key, existing_items[key])
+        metrics.count('ConstraintCacheHits', len(keys) - len(missing_keys))
+        metrics.count('ConstraintCacheMisses', len(missing_keys))
+    except Exception as e:
+        print(f"Error reading constraints for batch: {str(e)}")
+        for entry in latest.values():
+            failed_message_ids.extend(entry['message_ids'])
+        metrics.count('FailedEvents', len(failed_message_ids))
+        metrics.flush()
+        return {
+            'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_message_ids]
+        }
+    
+    with metrics.timer('RepriceTime'):
+        featured = [
+            find_featured_offer(latest[key]['notification']['lowest_prices'], latest[key]['notification']['offers'])
+            for key in keys
+        ]
+        items = [existing_items.get(key, {}) for key in keys]
+        status, new_prices, business_prices = reprice_batch(
+            [float('nan') if price is None else price for price, _ in featured],
+            we_are_featured=[is_featured for _, is_featured in featured],
+            **constraint_arrays(items)
+        )
+        
+        updates = []
+        unconstrained = 0
+        for i, key in enumerate(keys):
+            if status[i] != REPRICED:
+                continue
+            # Without a min_price from the ETL the floor would be 0 and the ceiling unbounded
+            if 'min_price' not in items[i]:
+                unconstrained += 1
+                continue
+            prices = (float(new_prices[i]), float(business_prices[i]))
+            if not is_noop_update(items[i], *prices):
+                updates.append((latest[key], prices))
+    
+    written = 0
+    skipped = 0
+    history_items = []
+    with metrics.timer('WriteTime'):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=BATCH_WRITE_CONCURRENCY) as executor:
+            futures = {
+                executor.submit(write_price_update, table, entry['notification'], new_price, business_price, context.aws_request_id): (entry, (new_price, business_price))
+                for entry, (new_price, business_price) in updates
+            }
+            for future in concurrent.futures.as_completed(futures):
+                entry, prices = futures[future]
+                try:
+                    if future.result():
+                        written += 1
+                        cache.record_write((entry['notification']['asin'], entry['notification']['marketplace_id']), *prices)
+                        history_items.append(competitor_history_item(entry['notification']))
+                    else:
+                        skipped += 1
+                except Exception as e:
+                    print(f"Error updating ASIN {entry['notification']['asin']}: {str(e)}")
+                    failed_message_ids.extend(entry['message_ids'])
+    
+    # Snapshots are best effort: a failure loses history, never a reprice
+    if HISTORY_TABLE and history_items:
+        try:
+            with metrics.timer('HistoryWriteTime'):
+                batch_put_items(dynamodb.Table(HISTORY_TABLE), history_items)
+        except Exception as e:
+            print(f"Error writing competitor history: {str(e)}")
+    
+    metrics.count('Events', len(records))
+    metrics.count('UniqueItems', len(latest))
+    metrics.count('UnconfiguredMarketplace', unconfigured)
+    metrics.count('NoConstraints', unconstrained)
+    metrics.count('Repriced', len(updates))
+    metrics.count('Written', written)
+    metrics.count('SkippedWrites', skipped)
+    metrics.count('FailedEvents', len(failed_message_ids))
+    metrics.flush()
+    print(f"Batch processed: {len(records)} events, {len(latest)} unique ASINs, {len(updates)} repriced, {written} written, {len(failed_message_ids)} failed")
+    
+    return {
+        'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_message_ids]
+    }
+
+def parse_event_time(event_time):
+    """Convert an SP-API EventTime string to epoch seconds, keeping milliseconds so same-second events still order"""
+    parsed = datetime.strptime(event_time, '%Y-%m-%dT%H:%M:%S.%fZ').replace(tzinfo=timezone.utc)
+    return Decimal(str(round(parsed.timestamp(), 3)))
+
+def parse_notification(event):
+    """Extract the fields we reprice on from an ANY_OFFER_CHANGED event, or None without ASIN/MarketplaceId
+    
+    Accepts the SP-API notification itself or an EventBridge envelope carrying it in `detail`.
+    """
+    if 'detail' in event:
+        event = event['detail']
+    
+    payload = event.get('Payload', {})
+    notification = payload.get('AnyOfferChangedNotification', {})
+    event_time = event.get('EventTime')
+    
+    # Extract ASIN and marketplace from OfferChangeTrigger
+    trigger = notification.get('OfferChangeTrigger', {})
+    asin = trigger.get('ASIN')
+    marketplace_id = trigger.get('MarketplaceId')
+    
+    if not asin or not marketplace_id:
+        return None
+    
+    return {
+        'asin': asin,
+        'marketplace_id': marketplace_id,
+        'event_time': event_time,
+        'timestamp': parse_event_time(event_time),
+        'offers': notification.get('Offers', []),
+        'lowest_prices': notification.get('Summary', {}).get('LowestPrices', [])
+    }
+
+def get_constraints(table, asin, marketplace_id):
+    """Return (item, cached): cached constraints for a repeat ASIN, else the full item read from DynamoDB"""
+    cache = get_constraint_cache()
+    cache.check_version(table)
+    
+    key = (asin, marketplace_id)
+    constraints = cache.get(key)
+    if constraints is not None:
+        return constraints, True
+    
+    item = table.get_item(Key={'asin': asin, 'marketplace_id': marketplace_id}).get('Item', {})
+    cache.put(key, item)
+    return item, False
+
+def is_noop_update(existing_item, new_price, business_price):
+    """True when the computed prices match what the item already holds
+
+    Compares against the pending updated_price/business_price, or when nothing is
+    pending, against the prices the patcher last pushed to Amazon.
+    """
+    if 'updated_price' in existing_item:
+        current = (existing_item.get('updated_price'), existing_item.get('business_price'))
+    else:
+        current = (existing_item.get('last_patched_price'), existing_item.get('last_patched_business_price'))
+    
+    return current == (Decimal(str(round(new_price, 2))), Decimal(str(round(business_price, 2))))
+
+def build_competitor_offers(offers):
+    """Convert notification offers to compact [seller_id, price, currency, condition, is_fba] rows"""
+    competitor_offers = []
+    for offer in offers:
+        listing_price = offer.get('ListingPrice', {})
+        if listing_price.get('Amount'):
+            competitor_offers.append([
+                offer.get('SellerId'),
+                str(listing_price['Amount']),
+                listing_price.get('CurrencyCode', 'USD'),
+                offer.get('SubCondition'),
+                offer.get('IsFulfilledByAmazon', False)
+            ])
+    return competitor_offers
+
+def build_competitor_summary(offers, seller_id=OUR_SELLER_ID):
+    """The fixed-size competitor_summary kept on the product item: lowest price, our rank by price, offer count"""
+    competitor_offers = build_competitor_offers(offers)
+    summary = {'offer_count': len(competitor_offers)}
+    if competitor_offers:
+        prices = sorted(Decimal(price) for _, price, _, _, _ in competitor_offers)
+        summary['lowest_price'] = prices[0]
+        ours = [Decimal(price) for seller, price, _, _, _ in competitor_offers if seller == seller_id]
+        if ours:
+            summary['our_rank'] = 1 + sum(1 for price in prices if price < ours[0])
+    return summary
+
+def encode_competitor_offers(competitor_offers):
+    """Pack compact offer rows as zlib-compressed JSON for the history table"""
+    return zlib.compress(json.dumps(competitor_offers, separators=(',', ':')).encode('utf-8'))
+
+def decode_competitor_offers(blob):
+    """Unpack a history snapshot back into competitor offer dicts"""
+    return [
+        {'seller_id': seller_id, 'price': Decimal(price), 'currency': currency, 'condition': condition, 'is_fba': is_fba}
+        for seller_id, price, currency, condition, is_fba in json.loads(zlib.decompress(bytes(blob)))
+    ]
+
+def competitor_history_item(notification):
+    """History row for one notification, keyed by listing and event time, expiring after HISTORY_TTL_DAYS"""
+    competitor_offers = build_competitor_offers(notification['offers'])
+    return {
+        'asin_marketplace': f"{notification['asin']}#{notification['marketplace_id']}",
+        'event_timestamp': notification['timestamp'],
+        'offers': encode_competitor_offers(competitor_offers),
+        'offer_count': len(competitor_offers),
+        'expires_at': int(time.time()) + HISTORY_TTL_DAYS * 86400
+    }
+
+def write_competitor_history(notification):
+    """Store one competitor snapshot; failures are logged, since history is best effort"""
+    if not HISTORY_TABLE:
+        return
+    try:
+        dynamodb.Table(HISTORY_TABLE).put_item(Item=competitor_history_item(notification))
+    except Exception as e:
+        print(f"Error writing competitor history for ASIN {notification['asin']}: {str(e)}")
+
+def patch_priority(offers, new_price, seller_id=OUR_SELLER_ID):
+    """Dispatch weight for the patcher: how far our listed price moves, plus FEATURED_LOSS_WEIGHT if our offer is live
+    
+    Reprices only happen while we are not featured, so a live offer of ours means a lost featured offer.
+    Listings where our offer is not in the notification get 0 and go last.
+    """
+    for offer in offers:
+        our_price = offer.get('ListingPrice', {}).get('Amount')
+        if offer.get('SellerId') == seller_id and our_price:
+            return Decimal(str(round(abs(float(our_price) - new_price) + FEATURED_LOSS_WEIGHT, 2)))
+    return Decimal('0')
+
+def write_price_update(table, notification, new_price, business_price, request_id):
+    """Store the repriced values and competitor summary, and mark the item pending for the patcher
+    
+    A new price resets the patch retry state and sets its patch_priority. The write only applies if the item was last updated from an older event and the
+    prices differ from the ones it already holds (see is_noop_update); returns False
+    otherwise. Uses the table's low-level client so batch writes can share it across threads.
+    """
+    asin = notification['asin']
+    try:
+        table.meta.client.update_item(
+            TableName=table.name,
+            Key={
+                'asin': asin,
+                'marketplace_id': notification['marketplace_id']
+            },
+            UpdateExpression=(
+                'SET updated_price = :price, business_price = :bprice, last_updated = :timestamp, last_updated_timestamp = :ts, '
+                'competitor_summary = :summary, pending_bucket = :bucket, patch_priority = :priority, patch_attempts = :zero '
+                'REMOVE competitor_offers, next_retry_at, patch_state'
+            ),
+            ConditionExpression=(
+                '(attribute_not_exists(last_updated_timestamp) OR last_updated_timestamp < :ts) AND NOT ('
+                '(attribute_exists(updated_price) AND updated_price = :price AND business_price = :bprice) OR '
+                '(attribute_not_exists(updated_price) AND last_patched_price = :price AND last_patched_business_price = :bprice))'
+            ),
+            ExpressionAttributeValues={
+                ':price': Decimal(str(round(new_price, 2))),
+                ':bprice': Decimal(str(round(business_price, 2))),
+                ':timestamp': request_id,
+                ':ts': notification['timestamp'],
+                ':summary': build_competitor_summary(notification['offers']),
+                ':bucket': pending_bucket(asin),
+                ':priority': patch_priority(notification['offers'], new_price),
+                ':zero': 0
+            }
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            print(f"Skipped stale or unchanged update for ASIN {asin} at {notification['event_time']}")
+            return False
+        raise
+
+# Only inside Lambda: locally (bench, tests) the fakes are wired in after import
+if 'AWS_LAMBDA_FUNCTION_NAME' in os.environ:
+    prewarm()
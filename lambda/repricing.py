@@ -0,0 +1,95 @@
+import numpy as np
+
+OUR_SELLER_ID = 'AERPN1UM8O1I4'
+
+# Outcome of the repricing rules for each ASIN
+REPRICED = 0
+ALREADY_FEATURED = 1
+NO_PRICE = 2
+BELOW_MIN = 3
+
+PRICE_STEP = 0.01
+
+
+def find_featured_offer(lowest_prices, offers, seller_id=OUR_SELLER_ID):
+    """Return (featured_offer_price, we_are_featured) from a notification's LowestPrices and Offers"""
+    featured_offer_price = None
+    we_are_featured = False
+
+    # Find the featured offer (lowest new price)
+    for price_info in lowest_prices:
+        if price_info.get('Condition') == 'new':
+            amount = price_info.get('ListingPrice', {}).get('Amount')
+            if amount:
+                featured_offer_price = amount
+                break
+
+    # Check if we are the featured seller
+    for offer in offers:
+        if offer.get('SellerId') == seller_id:
+            offer_price = offer.get('ListingPrice', {}).get('Amount')
+            if offer_price and offer_price == featured_offer_price:
+                we_are_featured = True
+                break
+
+    return featured_offer_price, we_are_featured
+
+
+def constraint_arrays(items):
+    """Pull min/max price constraints out of DynamoDB items as float arrays, with open bounds for missing values"""
+    def column(name, default):
+        return np.array([float(item.get(name, default)) for item in items], dtype=np.float64)
+
+    return {
+        'min_prices': column('min_price', 0),
+        'max_prices': column('max_price', np.inf),
+        'min_business_prices': column('min_business_price', 0),
+        'max_business_prices': column('max_business_price', np.inf)
+    }
+
+
+def reprice_batch(featured_prices, min_prices, max_prices, min_business_prices, max_business_prices,
+                  we_are_featured=None):
+    """Evaluate the repricing rules over arrays of featured prices and constraints
+
+    featured_prices uses NaN where a listing has no featured offer. Constraint
+    arrays broadcast against it. Returns (status, new_prices, business_prices);
+    prices are NaN wherever status is not REPRICED.
+    """
+    featured = np.asarray(featured_prices, dtype=np.float64)
+    shape = featured.shape
+    min_prices = np.broadcast_to(np.asarray(min_prices, dtype=np.float64), shape)
+    max_prices = np.broadcast_to(np.asarray(max_prices, dtype=np.float64), shape)
+    min_business_prices = np.broadcast_to(np.asarray(min_business_prices, dtype=np.float64), shape)
+    max_business_prices = np.broadcast_to(np.asarray(max_business_prices, dtype=np.float64), shape)
+
+    status = np.full(shape, REPRICED, dtype=np.int8)
+    if we_are_featured is not None:
+        status[np.asarray(we_are_featured, dtype=bool)] = ALREADY_FEATURED
+    status[(status == REPRICED) & np.isnan(featured)] = NO_PRICE
+
+    # One cent below the featured offer, only if that stays above our minimum
+    new_prices = featured - PRICE_STEP
+    status[(status == REPRICED) & (new_prices <= min_prices)] = BELOW_MIN
+    new_prices = np.minimum(new_prices, max_prices)
+
+    # Business price one cent below regular, clamped low-bound first
+    business_prices = new_prices - PRICE_STEP
+    business_prices = np.where(
+        business_prices < min_business_prices,
+        min_business_prices,
+        np.where(business_prices > max_business_prices, max_business_prices, business_prices)
+    )
+
+    rejected = status != REPRICED
+    new_prices[rejected] = np.nan
+    business_prices[rejected] = np.nan
+    return status, new_prices, business_prices
+
+
+def reprice_item(featured_offer_price, item):
+    """Apply the rules to one ASIN, returning (new_price, business_price) or None when at or below minimum"""
+    status, new_prices, business_prices = reprice_batch([featured_offer_price], **constraint_arrays([item]))
+    if status[0] != REPRICED:
+        return None
+    return float(new_prices[0]), float(business_prices[0])
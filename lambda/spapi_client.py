@@ -0,0 +1,200 @@
+import asyncio
+import concurrent.futures
+import json
+import random
+import time
+import urllib3
+from spapi_utils import loop_lock, SPAPI_ENDPOINTS, DEFAULT_REGION
+
+# Statuses worth another attempt: throttling and transient server errors
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# Documented (requests/second, burst) per operation, used until SP-API reports otherwise.
+# Each operation gets its own bucket so a slow one (createFeed) never starves patches.
+OPERATION_RATE_LIMITS = {
+    'patchListingsItem': (5.0, 10),
+    'createFeedDocument': (0.5, 15),
+    'createFeed': (0.0083, 15),
+    'getFeed': (2.0, 15),
+    'getFeedDocument': (0.0222, 10)
+}
+DEFAULT_RATE = 5.0
+DEFAULT_BURST = 10
+
+BACKOFF_BASE_SECONDS = 0.25
+BACKOFF_CAP_SECONDS = 8.0
+
+# One client (connection pool + rate limiters) per region, kept for the life of the container
+_clients = {}
+
+
+def deadline_from_context(context, reserve_seconds=10.0):
+    """Convert the Lambda time budget into a monotonic deadline, keeping some time in reserve"""
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return None
+    return time.monotonic() + context.get_remaining_time_in_millis() / 1000.0 - reserve_seconds
+
+
+class TokenBucket:
+    """Async token bucket whose refill rate follows SP-API's x-amzn-RateLimit-Limit header"""
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, share=1.0):
+        self.limit = rate
+        self.burst_limit = burst
+        self.share = share
+        self.rate = rate * share
+        self.burst = max(1.0, burst * share)
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+        self._lock = None
+        self._lock_loop = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        """Wait for a token; waiters are served in arrival order"""
+        async with loop_lock(self):
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+    def update_rate(self, rate):
+        """Adopt the rate SP-API reports for this operation"""
+        if rate > 0 and rate != self.limit:
+            self._refill()
+            self.limit = rate
+            self.rate = rate * self.share
+
+    def set_share(self, share):
+        """Use only this fraction of the operation's limit, e.g. when workers split one seller's quota"""
+        self._refill()
+        self.share = share
+        self.rate = self.limit * share
+        self.burst = max(1.0, self.burst_limit * share)
+        self.tokens = min(self.tokens, self.burst)
+
+    def throttle(self):
+        """Drain the bucket after a 429 so the next request waits a full refill interval"""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+
+
+class SPAPIResponse:
+    """Final outcome of a request, after any retries"""
+
+    def __init__(self, status, headers, data, attempts, throttles):
+        self.status = status
+        self.headers = headers
+        self.data = data
+        self.attempts = attempts
+        self.throttles = throttles
+
+    def json(self):
+        return json.loads(self.data.decode('utf-8')) if self.data else None
+
+
+class SPAPIClient:
+    """Asyncio SP-API client with a keep-alive connection pool, adaptive rate limit and jittered retries"""
+
+    def __init__(self, endpoint=SPAPI_ENDPOINTS[DEFAULT_REGION], max_connections=10, max_attempts=5):
+        self.endpoint = endpoint.rstrip('/')
+        self.max_attempts = max_attempts
+        self.limiters = {}
+        self.rate_share = 1.0
+        self.http = urllib3.PoolManager(
+            maxsize=max_connections,
+            block=True,
+            retries=False,
+            timeout=urllib3.Timeout(connect=3.0, read=15.0)
+        )
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_connections)
+
+    def _send(self, method, url, headers, body):
+        return self.http.request(method, url, headers=headers, body=body)
+
+    def limiter(self, operation):
+        """Return the token bucket for an SP-API operation"""
+        limiter = self.limiters.get(operation)
+        if limiter is None:
+            rate, burst = OPERATION_RATE_LIMITS.get(operation, (DEFAULT_RATE, DEFAULT_BURST))
+            limiter = self.limiters[operation] = TokenBucket(rate, burst, self.rate_share)
+        return limiter
+
+    def set_rate_share(self, share):
+        """Scale every operation's rate limit to the share of the seller's quota this invocation may use
+
+        SP-API limits are per seller account, so N concurrent patcher workers each take 1/N.
+        """
+        self.rate_share = share
+        for limiter in self.limiters.values():
+            limiter.set_share(share)
+
+    def _observe_rate_limit(self, limiter, headers):
+        limit = headers.get('x-amzn-RateLimit-Limit')
+        if limit:
+            try:
+                limiter.update_rate(float(limit))
+            except ValueError:
+                pass
+
+    async def request(self, method, path, access_token, body=None, deadline=None, operation='patchListingsItem'):
+        """Send one SP-API call, retrying 429/5xx with full-jitter backoff while the deadline allows"""
+        loop = asyncio.get_running_loop()
+        limiter = self.limiter(operation)
+        url = f'{self.endpoint}{path}'
+        headers = {
+            'x-amz-access-token': access_token,
+            'Content-Type': 'application/json'
+        }
+        payload = json.dumps(body) if body is not None else None
+
+        attempts = 0
+        throttles = 0
+        while True:
+            attempts += 1
+            await limiter.acquire()
+
+            try:
+                response = await loop.run_in_executor(self.executor, self._send, method, url, headers, payload)
+                status, response_headers, data = response.status, response.headers, response.data
+            except urllib3.exceptions.HTTPError as e:
+                print(f"SP-API {method} {path} attempt {attempts} failed: {str(e)}")
+                status, response_headers, data = None, {}, b''
+
+            self._observe_rate_limit(limiter, response_headers)
+
+            if status is not None and status not in RETRYABLE_STATUSES:
+                return SPAPIResponse(status, response_headers, data, attempts, throttles)
+
+            if status == 429:
+                throttles += 1
+                limiter.throttle()
+
+            delay = random.uniform(0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempts))
+            out_of_time = deadline is not None and time.monotonic() + delay >= deadline
+            if attempts >= self.max_attempts or out_of_time:
+                return SPAPIResponse(status, response_headers, data, attempts, throttles)
+
+            await asyncio.sleep(delay)
+
+    async def transfer(self, method, url, body=None, headers=None):
+        """Upload or download a feed document at its pre-signed URL (no access token, no SP-API rate limit)"""
+        loop = asyncio.get_running_loop()
+        response = await loop.run_in_executor(self.executor, self._send, method, url, headers or {}, body)
+        return SPAPIResponse(response.status, response.headers, response.data, 1, 0)
+
+
+def get_spapi_client(region=DEFAULT_REGION):
+    """Return the container-wide client for a region's endpoint, creating it on first use
+
+    SP-API rate limits apply per region, so each region gets its own limiters as well as its own pool.
+    """
+    client = _clients.get(region)
+    if client is None:
+        client = _clients[region] = SPAPIClient(SPAPI_ENDPOINTS[region])
+    return client
@@ -1,8 +1,42 @@
+import asyncio
 import json
 import os
+import time
+import urllib.parse
 import boto3
+import urllib3
 from functools import lru_cache
 
+LWA_TOKEN_URL = os.environ.get('LWA_TOKEN_URL', 'https://api.amazon.com/auth/o2/token')
+
+# Refresh this long before expires_in runs out so no request carries a token about to lapse
+TOKEN_REFRESH_MARGIN_SECONDS = 300
+
+# Selling Partner API host per region; SPAPI_ENDPOINT[_EU|_FE] points a region elsewhere (sandbox, bench)
+SPAPI_ENDPOINTS = {
+    'na': os.environ.get('SPAPI_ENDPOINT', 'https://sellingpartnerapi-na.amazon.com'),
+    'eu': os.environ.get('SPAPI_ENDPOINT_EU', 'https://sellingpartnerapi-eu.amazon.com'),
+    'fe': os.environ.get('SPAPI_ENDPOINT_FE', 'https://sellingpartnerapi-fe.amazon.com')
+}
+DEFAULT_REGION = 'na'
+
+# Marketplaces we can patch: region (endpoint and LWA authorization) and listing currency
+MARKETPLACES = {
+    'ATVPDKIKX0DER': {'country': 'US', 'region': 'na', 'currency': 'USD'},
+    'A2EUQ1WTGCTBG2': {'country': 'CA', 'region': 'na', 'currency': 'CAD'},
+    'A1AM78C64UM0Y8': {'country': 'MX', 'region': 'na', 'currency': 'MXN'},
+    'A2Q3Y263D00KWC': {'country': 'BR', 'region': 'na', 'currency': 'BRL'},
+    'A1F83G8C2ARO7P': {'country': 'UK', 'region': 'eu', 'currency': 'GBP'},
+    'A1PA6795UKMFR9': {'country': 'DE', 'region': 'eu', 'currency': 'EUR'},
+    'A13V1IB3VIYZZH': {'country': 'FR', 'region': 'eu', 'currency': 'EUR'},
+    'APJ6JRA9NG5V4': {'country': 'IT', 'region': 'eu', 'currency': 'EUR'},
+    'A1RKKUPIHCS9HS': {'country': 'ES', 'region': 'eu', 'currency': 'EUR'},
+    'A1VC38T7YXB528': {'country': 'JP', 'region': 'fe', 'currency': 'JPY'}
+}
+DEFAULT_MARKETPLACE_ID = 'ATVPDKIKX0DER'
+
+_http = urllib3.PoolManager()
+
 @lru_cache(maxsize=1)
 def get_spapi_credentials():
     """Get SP-API credentials from Secrets Manager"""
@@ -11,11 +45,128 @@ def get_spapi_credentials():
         response = client.get_secret_value(SecretId='terratreeOrders/spapi')
         secrets = json.loads(response['SecretString'])
         
-        return {
+        credentials = {
             'lwa_app_id': secrets['lwa_app_id'],
             'lwa_client_secret': secrets['lwa_client_secret'],
             'refresh_token': secrets['refresh_token']
         }
+        # Sellers authorize each region separately; refresh_token_eu etc. override the default
+        for region in SPAPI_ENDPOINTS:
+            if f'refresh_token_{region}' in secrets:
+                credentials[f'refresh_token_{region}'] = secrets[f'refresh_token_{region}']
+        return credentials
     except Exception as e:
         print(f"Error getting SP-API credentials from terratreeOrders/spapi: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+
+def get_marketplace_ids():
+    """Marketplaces this deployment patches, from MARKETPLACE_IDS (comma-separated) or MARKETPLACE_ID"""
+    value = os.environ.get('MARKETPLACE_IDS') or os.environ.get('MARKETPLACE_ID', DEFAULT_MARKETPLACE_ID)
+    marketplace_ids = list(dict.fromkeys(part.strip() for part in value.split(',') if part.strip()))
+    unknown = [marketplace_id for marketplace_id in marketplace_ids if marketplace_id not in MARKETPLACES]
+    if unknown:
+        raise ValueError(f"Unknown marketplace IDs {unknown}; add them to spapi_utils.MARKETPLACES")
+    return marketplace_ids
+
+def marketplace_region(marketplace_id):
+    """SP-API region ('na', 'eu' or 'fe') serving a marketplace"""
+    return MARKETPLACES[marketplace_id]['region']
+
+def marketplace_currency(marketplace_id):
+    """Currency code listings in a marketplace are priced in"""
+    return MARKETPLACES[marketplace_id]['currency']
+
+def marketplaces_by_region(marketplace_ids):
+    """Group marketplace IDs by SP-API region, keeping their order"""
+    regions = {}
+    for marketplace_id in marketplace_ids:
+        regions.setdefault(marketplace_region(marketplace_id), []).append(marketplace_id)
+    return regions
+
+def loop_lock(owner):
+    """Return an asyncio.Lock bound to the running loop, replacing one left over from a previous invocation"""
+    loop = asyncio.get_running_loop()
+    if owner._lock is None or owner._lock_loop is not loop:
+        owner._lock = asyncio.Lock()
+        owner._lock_loop = loop
+    return owner._lock
+
+def fetch_access_token(region=DEFAULT_REGION):
+    """Exchange a region's LWA refresh token for an access token, returning (access_token, expires_in)"""
+    spapi_creds = get_spapi_credentials()
+    
+    payload = {
+        'grant_type': 'refresh_token',
+        'refresh_token': spapi_creds.get(f'refresh_token_{region}', spapi_creds['refresh_token']),
+        'client_id': spapi_creds['lwa_app_id'],
+        'client_secret': spapi_creds['lwa_client_secret']
+    }
+    
+    response = _http.request(
+        'POST',
+        LWA_TOKEN_URL,
+        body=urllib.parse.urlencode(payload),
+        headers={'Content-Type': 'application/x-www-form-urlencoded'}
+    )
+    if response.status != 200:
+        raise RuntimeError(f"Token refresh failed: {response.status} - {response.data.decode('utf-8')}")
+    
+    token_data = json.loads(response.data.decode('utf-8'))
+    return token_data['access_token'], int(token_data.get('expires_in', 3600))
+
+class LWATokenProvider:
+    """Per-container LWA access-token cache shared by every SP-API caller in one region"""
+    
+    def __init__(self, region=DEFAULT_REGION, refresh_margin=TOKEN_REFRESH_MARGIN_SECONDS):
+        self.region = region
+        self.refresh_margin = refresh_margin
+        self.access_token = None
+        self.expires_at = 0.0
+        self.hits = 0
+        self.refreshes = 0
+        self._lock = None
+        self._lock_loop = None
+    
+    def _is_fresh(self):
+        return self.access_token is not None and time.monotonic() < self.expires_at - self.refresh_margin
+    
+    async def get_token(self):
+        """Return the cached token, refreshing it once for all concurrent callers when near expiry"""
+        if self._is_fresh():
+            self.hits += 1
+            return self.access_token
+        
+        async with loop_lock(self):
+            # Another coroutine may have refreshed while we waited for the lock
+            if self._is_fresh():
+                self.hits += 1
+                return self.access_token
+            
+            loop = asyncio.get_running_loop()
+            access_token, expires_in = await loop.run_in_executor(None, fetch_access_token, self.region)
+            return self._store(access_token, expires_in)
+    
+    def prime(self):
+        """Fetch a token synchronously, e.g. during the Lambda init phase before any event loop runs"""
+        if not self._is_fresh():
+            self._store(*fetch_access_token(self.region))
+    
+    def _store(self, access_token, expires_in):
+        self.access_token = access_token
+        self.expires_at = time.monotonic() + expires_in
+        self.refreshes += 1
+        return access_token
+    
+    def invalidate(self):
+        """Drop the cached token, e.g. after SP-API rejects it"""
+        self.access_token = None
+        self.expires_at = 0.0
+
+_token_providers = {}
+
+def get_token_provider(region=DEFAULT_REGION):
+    """Return the container-wide LWA token provider for a region, creating it on first use"""
+    provider = _token_providers.get(region)
+    if provider is None:
+        provider = _token_providers[region] = LWATokenProvider(region)
+    return provider
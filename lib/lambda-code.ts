@@ -0,0 +1,28 @@
+import * as lambda from 'aws-cdk-lib/aws-lambda';
+
+// Modules each handler imports, as reported by bench/startup_bench.py
+export const PRICE_UPDATE_MODULES = ['price_update_handler', 'dynamo_utils', 'repricing', 'metrics', 'constraint_cache'];
+export const PRICE_PATCHER_MODULES = ['price_patcher', 'spapi_utils', 'spapi_client', 'dynamo_utils', 'metrics'];
+// etl/ modules the Spark-free stream sync Lambda imports
+export const STREAM_SYNC_MODULES = ['stream_sync', 'etl_common'];
+
+// Package only the given modules of sourceDir, plus any pip packages the Lambda runtime lacks
+export function handlerCode(modules: string[], packages: string[] = [], sourceDir: string = 'lambda'): lambda.Code {
+  const exclude = ['*', ...modules.map(name => `!${name}.py`)];
+  if (packages.length === 0) {
+    return lambda.Code.fromAsset(sourceDir, { exclude });
+  }
+
+  return lambda.Code.fromAsset(sourceDir, {
+    exclude,
+    bundling: {
+      image: lambda.Runtime.PYTHON_3_11.bundlingImage,
+      command: [
+        'bash', '-c',
+        // exclude only shapes the asset hash; /asset-input is the whole directory, so copy just the listed modules
+        `pip install --no-cache-dir ${packages.map(name => `'${name}'`).join(' ')} -t /asset-output && ` +
+        `cp ${modules.map(name => `/asset-input/${name}.py`).join(' ')} /asset-output/`
+      ]
+    }
+  });
+}
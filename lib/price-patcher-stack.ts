@@ -1,28 +1,46 @@
-import { Stack, StackProps, Duration } from 'aws-cdk-lib';
+import { Stack, StackProps, Duration, ArnFormat } from 'aws-cdk-lib';
 import { Construct } from 'constructs';
 import * as lambda from 'aws-cdk-lib/aws-lambda';
+import * as iam from 'aws-cdk-lib/aws-iam';
 import * as events from 'aws-cdk-lib/aws-events';
 import * as targets from 'aws-cdk-lib/aws-events-targets';
 import * as dynamodb from 'aws-cdk-lib/aws-dynamodb';
 import * as secretsmanager from 'aws-cdk-lib/aws-secretsmanager';
+import { DynamoEventSource } from 'aws-cdk-lib/aws-lambda-event-sources';
+import { handlerCode, PRICE_PATCHER_MODULES } from './lambda-code';
+
+export interface PricePatcherStackProps extends StackProps {
+  // terratree-products, created with a NEW_AND_OLD_IMAGES stream by PriceUpdateLambdaStack
+  productsTable: dynamodb.ITable;
+}
 
 export class PricePatcherStack extends Stack {
-  constructor(scope: Construct, id: string, props?: StackProps) {
+  constructor(scope: Construct, id: string, props: PricePatcherStackProps) {
     super(scope, id, props);
 
-    // Reference secrets and DynamoDB table
+    // Reference secrets
     const dbSecret = secretsmanager.Secret.fromSecretNameV2(this, 'DatabaseSecret', 'terratree/production_db');
     const spapiSecret = secretsmanager.Secret.fromSecretNameV2(this, 'SpapiSecret', 'terratreeOrders/spapi');
-    const productsTable = dynamodb.Table.fromTableName(this, 'ProductsTable', 'terratree-products');
+    const productsTable = props.productsTable;
 
-    // Price Patcher Lambda
+    // Price Patcher Lambda; named so it can invoke itself for fan-out and checkpoints
+    const patcherFunctionName = 'terratree-price-patcher';
     const patcherLambda = new lambda.Function(this, 'PricePatcherHandler', {
+      functionName: patcherFunctionName,
       runtime: lambda.Runtime.PYTHON_3_11,
       handler: 'price_patcher.lambda_handler',
-      code: lambda.Code.fromAsset('lambda'),
+      code: handlerCode(PRICE_PATCHER_MODULES),
       environment: {
         DYNAMODB_TABLE: 'terratree-products',
-        MARKETPLACE_ID: 'ATVPDKIKX0DER',
+        // Comma-separated; each SP-API region's marketplaces run as one concurrent pipeline
+        MARKETPLACE_IDS: 'ATVPDKIKX0DER',
+        PENDING_INDEX_NAME: 'pending-patch-index',
+        PENDING_BUCKETS: '10',
+        SELLER_ID: 'AERPN1UM8O1I4',
+        FEED_THRESHOLD: '500',
+        MAX_WORKERS: '5',
+        ITEMS_PER_WORKER: '2000',
+        MAX_CONTINUATIONS: '8',
         DB_SECRET_ARN: dbSecret.secretArn
       },
       timeout: Duration.minutes(5),
@@ -34,7 +52,49 @@ export class PricePatcherStack extends Stack {
     dbSecret.grantRead(patcherLambda);
     spapiSecret.grantRead(patcherLambda);
 
-    // Schedule hourly execution
+    // Allow worker and continuation self-invocations (ARN built from the name to avoid a dependency cycle)
+    patcherLambda.addToRolePolicy(new iam.PolicyStatement({
+      actions: ['lambda:InvokeFunction'],
+      resources: [this.formatArn({
+        service: 'lambda',
+        resource: 'function',
+        resourceName: patcherFunctionName,
+        arnFormat: ArnFormat.COLON_RESOURCE_NAME
+      })]
+    }));
+
+    // Stream-driven patcher: pushes each reprice within seconds. The batching window
+    // is the per-ASIN debounce, since reprices within one batch coalesce into one PATCH
+    const streamPatcherLambda = new lambda.Function(this, 'PriceStreamPatcherHandler', {
+      runtime: lambda.Runtime.PYTHON_3_11,
+      handler: 'price_patcher.stream_lambda_handler',
+      code: handlerCode(PRICE_PATCHER_MODULES),
+      environment: {
+        DYNAMODB_TABLE: 'terratree-products',
+        MARKETPLACE_IDS: 'ATVPDKIKX0DER',
+        PENDING_INDEX_NAME: 'pending-patch-index',
+        PENDING_BUCKETS: '10'
+      },
+      timeout: Duration.minutes(2),
+      memorySize: 512
+    });
+
+    productsTable.grantReadWriteData(streamPatcherLambda);
+    spapiSecret.grantRead(streamPatcherLambda);
+
+    streamPatcherLambda.addEventSource(new DynamoEventSource(productsTable, {
+      startingPosition: lambda.StartingPosition.LATEST,
+      batchSize: 100,
+      maxBatchingWindow: Duration.seconds(5),
+      bisectBatchOnError: true,
+      retryAttempts: 3,
+      // Only rows that still carry a price to push; the patcher's own commit removes it
+      filters: [lambda.FilterCriteria.filter({
+        dynamodb: { NewImage: { updated_price: { N: lambda.FilterRule.exists() } } }
+      })]
+    }));
+
+    // Hourly sweeper for anything the stream path missed or failed to patch
     const hourlyRule = new events.Rule(this, 'HourlyPatcherTrigger', {
       schedule: events.Schedule.rate(Duration.hours(1))
     });
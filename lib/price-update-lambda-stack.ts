@@ -6,8 +6,13 @@ import * as events from 'aws-cdk-lib/aws-events';
 import * as targets from 'aws-cdk-lib/aws-events-targets';
 import * as dynamodb from 'aws-cdk-lib/aws-dynamodb';
 import * as secretsmanager from 'aws-cdk-lib/aws-secretsmanager';
+import * as sqs from 'aws-cdk-lib/aws-sqs';
+import { SqsEventSource } from 'aws-cdk-lib/aws-lambda-event-sources';
+import { handlerCode, PRICE_UPDATE_MODULES } from './lambda-code';
 
 export class PriceUpdateLambdaStack extends Stack {
+  public readonly productsTable: dynamodb.Table;
+
   constructor(scope: Construct, id: string, props?: StackProps) {
     super(scope, id, props);
 
@@ -15,22 +20,49 @@ export class PriceUpdateLambdaStack extends Stack {
     const dbSecret = secretsmanager.Secret.fromSecretNameV2(this, 'DatabaseSecret', 'terratree/production_db');
     const spapiSecret = secretsmanager.Secret.fromSecretNameV2(this, 'SpapiSecret', 'terratreeOrders/spapi');
 
-    // Create DynamoDB table
+    // Create DynamoDB table; its stream drives near-real-time patching in PricePatcherStack
     const productsTable = new dynamodb.Table(this, 'ProductsTable', {
       tableName: 'terratree-products',
       partitionKey: { name: 'asin', type: dynamodb.AttributeType.STRING },
-      sortKey: { name: 'marketplace_id', type: dynamodb.AttributeType.STRING }
+      sortKey: { name: 'marketplace_id', type: dynamodb.AttributeType.STRING },
+      stream: dynamodb.StreamViewType.NEW_AND_OLD_IMAGES
+    });
+    this.productsTable = productsTable;
+
+    // Sparse index of items waiting to be patched: only rows carrying
+    // pending_bucket (written with updated_price) are projected into it, and
+    // only with the attributes the patcher reads, so index writes stay small
+    productsTable.addGlobalSecondaryIndex({
+      indexName: 'pending-patch-index',
+      partitionKey: { name: 'pending_bucket', type: dynamodb.AttributeType.NUMBER },
+      sortKey: { name: 'last_updated_timestamp', type: dynamodb.AttributeType.NUMBER },
+      projectionType: dynamodb.ProjectionType.INCLUDE,
+      nonKeyAttributes: ['updated_price', 'business_price', 'patch_priority', 'patch_attempts', 'next_retry_at', 'min_price']
+    });
+
+    // Compressed competitor snapshots, kept off the hot product item and expired by TTL
+    const historyTable = new dynamodb.Table(this, 'CompetitorHistoryTable', {
+      tableName: 'terratree-competitor-history',
+      partitionKey: { name: 'asin_marketplace', type: dynamodb.AttributeType.STRING },
+      sortKey: { name: 'event_timestamp', type: dynamodb.AttributeType.NUMBER },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      timeToLiveAttribute: 'expires_at'
     });
 
     // Define the Lambda function
     const priceLambda = new lambda.Function(this, 'PriceUpdateHandler', {
       runtime: lambda.Runtime.PYTHON_3_11,
-      handler: 'price_update_handler.lambda_handler',
-      code: lambda.Code.fromAsset('lambda'),
+      handler: 'price_update_handler.batch_lambda_handler',
+      // Only the modules this handler imports, plus numpy for the repricing engine
+      code: handlerCode(PRICE_UPDATE_MODULES, ['numpy>=1.24.0']),
       environment: {
         DYNAMODB_TABLE: 'terratree-products',
         MARKUP_PERCENTAGE: '15',
-        MARKETPLACE_ID: 'ATVPDKIKX0DER',
+        // Must match the patcher's MARKETPLACE_IDS
+        MARKETPLACE_IDS: 'ATVPDKIKX0DER',
+        PENDING_BUCKETS: '10',
+        HISTORY_TABLE: 'terratree-competitor-history',
+        HISTORY_TTL_DAYS: '30',
         DB_SECRET_ARN: dbSecret.secretArn
       },
       timeout: Duration.seconds(30),
@@ -39,16 +71,31 @@ export class PriceUpdateLambdaStack extends Stack {
 
     // Grant DynamoDB and Secrets Manager access
     productsTable.grantReadWriteData(priceLambda);
+    historyTable.grantWriteData(priceLambda);
     dbSecret.grantRead(priceLambda);
     spapiSecret.grantRead(priceLambda);
 
-    // Allow Lambda to be triggered by EventBridge
+    // Buffer offer-change events in SQS so the Lambda receives them in batches
+    const priceEventDlq = new sqs.Queue(this, 'PriceChangeEventDLQ', {
+      retentionPeriod: Duration.days(4)
+    });
+    const priceEventQueue = new sqs.Queue(this, 'PriceChangeEventQueue', {
+      visibilityTimeout: Duration.seconds(180),
+      deadLetterQueue: { queue: priceEventDlq, maxReceiveCount: 5 }
+    });
+
     const eventRule = new events.Rule(this, 'PriceChangeEventRule', {
       eventPattern: {
         source: ['aws.partner/sellingpartnerapi.amazon.com'],
         detailType: ['ANY_OFFER_CHANGED']
       }
     });
-    eventRule.addTarget(new targets.LambdaFunction(priceLambda));
+    eventRule.addTarget(new targets.SqsQueue(priceEventQueue));
+
+    priceLambda.addEventSource(new SqsEventSource(priceEventQueue, {
+      batchSize: 100,
+      maxBatchingWindow: Duration.seconds(5),
+      reportBatchItemFailures: true
+    }));
   }
 }
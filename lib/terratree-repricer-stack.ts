@@ -7,8 +7,10 @@ import * as events from 'aws-cdk-lib/aws-events';
 import * as targets from 'aws-cdk-lib/aws-events-targets';
 import * as secretsmanager from 'aws-cdk-lib/aws-secretsmanager';
 import * as s3deploy from 'aws-cdk-lib/aws-s3-deployment';
+import * as lambda from 'aws-cdk-lib/aws-lambda';
 import { PriceUpdateLambdaStack } from './price-update-lambda-stack';
 import { PricePatcherStack } from './price-patcher-stack';
+import { handlerCode, STREAM_SYNC_MODULES } from './lambda-code';
 
 
 export class TerratreeRepricerStack extends Stack {
@@ -62,9 +64,18 @@ export class TerratreeRepricerStack extends Stack {
       defaultArguments: {
         '--TempDir': 's3://terratreerepricerstack-gluescriptbucket705d6cca-zolk54rusf8m/temp/',
         '--job-language': 'python',
+        '--extra-py-files': 's3://terratreerepricerstack-gluescriptbucket705d6cca-zolk54rusf8m/etl/etl_common.py',
         '--JOB_NAME': 'terratree-etl-job',
         '--DB_SECRET_ARN': dbSecret.secretArn,
         '--DYNAMODB_TABLE': 'terratree-products',
+        '--SYNC_MODE': 'delta',
+        '--STATE_PATH': 's3://terratreerepricerstack-gluescriptbucket705d6cca-zolk54rusf8m/etl-state/products/',
+        '--PARTITION_COLUMN': 'id',
+        '--NUM_PARTITIONS': '8',
+        '--FETCH_SIZE': '5000',
+        // Leave the other half of terratree-products' write capacity to live repricing
+        '--WRITE_CAPACITY_SHARE': '0.5',
+        '--MARKETPLACE_IDS': 'ATVPDKIKX0DER',
         '--etl-enable-container-telemetry': 'true'
       },
       glueVersion: '4.0',
@@ -91,11 +102,36 @@ export class TerratreeRepricerStack extends Stack {
       }),
     }));
 
+    // Spark-free sync for intra-day refreshes; invoke on demand or run etl/stream_sync.py locally
+    const streamSyncLambda = new lambda.Function(this, 'ProductStreamSync', {
+      runtime: lambda.Runtime.PYTHON_3_11,
+      handler: 'stream_sync.lambda_handler',
+      // etl_common imports pymysql, which the Python runtime does not provide
+      code: handlerCode(STREAM_SYNC_MODULES, ['pymysql>=1.0.0'], 'etl'),
+      environment: {
+        DB_SECRET_ARN: dbSecret.secretArn,
+        DYNAMODB_TABLE: 'terratree-products',
+        MARKETPLACE_IDS: 'ATVPDKIKX0DER',
+        SYNC_CHUNK_SIZE: '500',
+        SYNC_WRITER_THREADS: '8',
+        SYNC_WRITE_CAPACITY_SHARE: '0.5'
+      },
+      timeout: Duration.minutes(15),
+      memorySize: 1024
+    });
+    dbSecret.grantRead(streamSyncLambda);
+    streamSyncLambda.addToRolePolicy(new iam.PolicyStatement({
+      actions: ['dynamodb:UpdateItem', 'dynamodb:DescribeTable'],
+      resources: [`arn:aws:dynamodb:${this.region}:${this.account}:table/terratree-products`]
+    }));
+
     // Add the Price Update Lambda Stack
-    new PriceUpdateLambdaStack(this, 'PriceUpdateLambda');
+    const priceUpdateStack = new PriceUpdateLambdaStack(this, 'PriceUpdateLambda');
     
-    // Add the Price Patcher Lambda Stack
-    new PricePatcherStack(this, 'PricePatcher');
+    // Add the Price Patcher Lambda Stack, fed by the products table's stream
+    new PricePatcherStack(this, 'PricePatcher', {
+      productsTable: priceUpdateStack.productsTable
+    });
 
   }
 }
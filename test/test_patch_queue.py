@@ -0,0 +1,191 @@
+"""Checks the pending-patch queue's conditional writes against the bench's DynamoDB fake.
+
+    python -m pytest test
+"""
+import asyncio
+import json
+import os
+import sys
+from decimal import Decimal
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'lambda'))
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import price_patcher  # noqa: E402
+import spapi_client  # noqa: E402
+from dynamo_utils import (  # noqa: E402
+    clear_patched_item, record_patch_failure, dead_letter_item, backfill_pending_buckets, query_pending_bucket,
+    pending_bucket, MAX_PATCH_ATTEMPTS, PENDING_INDEX_NAME, PATCH_STATE_DEAD
+)
+from fake_dynamodb import FakeDynamoDB  # noqa: E402
+from metrics import Metrics  # noqa: E402
+
+MARKETPLACE_ID = 'ATVPDKIKX0DER'
+
+
+@pytest.fixture
+def table():
+    database = FakeDynamoDB()
+    return database.create_table(
+        'terratree-products', indexes={PENDING_INDEX_NAME: ('pending_bucket', 'last_updated_timestamp')}
+    )
+
+
+def seed(table, asin, price='19.99', timestamp='100.000', **attributes):
+    """Store an item as price_update_handler leaves it after a reprice, and return it as the patcher reads it"""
+    item = {
+        'asin': asin,
+        'marketplace_id': MARKETPLACE_ID,
+        'min_price': Decimal('5'),
+        'updated_price': Decimal(price),
+        'business_price': Decimal(price) - Decimal('0.01'),
+        'last_updated_timestamp': Decimal(timestamp),
+        'pending_bucket': pending_bucket(asin),
+        'patch_attempts': 0,
+        **attributes
+    }
+    table.put_item(Item=item)
+    return dict(item)
+
+
+def stored(table, asin):
+    return table.get_item(Key={'asin': asin, 'marketplace_id': MARKETPLACE_ID})['Item']
+
+
+def test_patch_commit_clears_pending_flags(table):
+    item = seed(table, 'B000000001')
+    assert clear_patched_item(table, item)
+    after = stored(table, 'B000000001')
+    assert 'updated_price' not in after and 'pending_bucket' not in after
+    assert after['last_patched_price'] == Decimal('19.99')
+
+
+def test_reprice_during_patch_is_not_cleared(table):
+    item = seed(table, 'B000000001')
+    # A newer event reprices the item while its old price is being patched
+    seed(table, 'B000000001', price='18.50', timestamp='200.000')
+
+    assert not clear_patched_item(table, item)
+    after = stored(table, 'B000000001')
+    assert after['updated_price'] == Decimal('18.50')
+    assert after['pending_bucket'] == pending_bucket('B000000001')
+    assert 'last_patched_price' not in after
+
+
+def test_failure_schedules_backed_off_retry(table):
+    item = seed(table, 'B000000001')
+    assert record_patch_failure(table, item, now=1000) == 'retry'
+    after = stored(table, 'B000000001')
+    assert after['patch_attempts'] == 1
+    assert after['next_retry_at'] > 1000
+    assert query_pending_bucket(table, pending_bucket('B000000001'), due_before=1000) == []
+
+
+def test_failure_after_reprice_is_ignored(table):
+    item = seed(table, 'B000000001')
+    seed(table, 'B000000001', price='18.50', timestamp='200.000')
+
+    assert record_patch_failure(table, item, now=1000) is None
+    after = stored(table, 'B000000001')
+    assert after['patch_attempts'] == 0
+    assert 'next_retry_at' not in after
+
+
+def test_attempt_limit_dead_letters_item(table):
+    item = seed(table, 'B000000001', patch_attempts=MAX_PATCH_ATTEMPTS - 1)
+    assert record_patch_failure(table, item, now=1000) == 'dead'
+    after = stored(table, 'B000000001')
+    assert after['patch_state'] == PATCH_STATE_DEAD
+    assert after['patch_attempts'] == MAX_PATCH_ATTEMPTS
+    assert 'pending_bucket' not in after
+    assert query_pending_bucket(table, pending_bucket('B000000001')) == []
+
+
+def test_dead_letter_skips_repriced_item(table):
+    item = seed(table, 'B000000001')
+    seed(table, 'B000000001', price='18.50', timestamp='200.000')
+    assert not dead_letter_item(table, item)
+    assert 'patch_state' not in stored(table, 'B000000001')
+
+
+def test_backfill_indexes_only_live_unindexed_items(table):
+    seed(table, 'B000000001')
+    table.update_item(
+        Key={'asin': 'B000000002', 'marketplace_id': MARKETPLACE_ID},
+        UpdateExpression='SET updated_price = :price, last_updated_timestamp = :ts',
+        ExpressionAttributeValues={':price': Decimal('9.99'), ':ts': Decimal('100.000')}
+    )
+    table.update_item(
+        Key={'asin': 'B000000003', 'marketplace_id': MARKETPLACE_ID},
+        UpdateExpression='SET updated_price = :price, last_updated_timestamp = :ts, patch_state = :dead',
+        ExpressionAttributeValues={':price': Decimal('9.99'), ':ts': Decimal('100.000'), ':dead': PATCH_STATE_DEAD}
+    )
+
+    assert backfill_pending_buckets(table) == 1
+    assert stored(table, 'B000000002')['pending_bucket'] == pending_bucket('B000000002')
+    assert 'pending_bucket' not in stored(table, 'B000000003')
+    assert backfill_pending_buckets(table) == 0
+
+
+class Response:
+    def __init__(self, status, payload=None, data=b''):
+        self.status = status
+        self.payload = payload
+        self.data = data
+
+    def json(self):
+        return self.payload
+
+
+class FeedClient:
+    """SP-API client stand-in that accepts a feed and reports it with the given final status and report"""
+
+    def __init__(self, status, report=None):
+        self.status = status
+        self.report = report or {'issues': []}
+
+    async def request(self, method, path, access_token, body=None, deadline=None, operation=None):
+        if operation == 'createFeedDocument':
+            return Response(201, {'feedDocumentId': 'doc-1', 'url': 'https://upload'})
+        if operation == 'createFeed':
+            return Response(202, {'feedId': 'feed-1'})
+        if operation == 'getFeed':
+            return Response(200, {'processingStatus': self.status, 'resultFeedDocumentId': 'result-1'})
+        return Response(200, {'url': 'https://report'})
+
+    async def transfer(self, method, url, body=None, headers=None):
+        return Response(200, data=json.dumps(self.report).encode('utf-8'))
+
+
+def patch_by_feed(table, items, client, monkeypatch):
+    monkeypatch.setitem(spapi_client._clients, 'na', client)
+    return asyncio.run(price_patcher.patch_by_feed(table, items, 'token', MARKETPLACE_ID, None, Metrics('test')))
+
+
+@pytest.mark.parametrize('status', ['FATAL', 'CANCELLED'])
+def test_feed_that_never_reaches_done_leaves_items_untouched(table, monkeypatch, status):
+    items = [seed(table, f'B00000000{i}') for i in range(3)]
+    before = [stored(table, item['asin']) for item in items]
+
+    assert patch_by_feed(table, items, FeedClient(status), monkeypatch) == (0, True)
+    assert [stored(table, item['asin']) for item in items] == before
+
+
+def test_feed_report_errors_count_as_attempts(table, monkeypatch):
+    items = [seed(table, f'B00000000{i}') for i in range(3)]
+    _, message_items = price_patcher.create_feed_document(items, MARKETPLACE_ID)
+    rejected_id = next(message_id for message_id, item in message_items.items() if item['asin'] == 'B000000001')
+    report = {'issues': [
+        {'messageId': rejected_id, 'severity': 'ERROR', 'code': '90000', 'message': 'Invalid price'},
+        {'messageId': rejected_id + 1, 'severity': 'WARNING', 'code': '18000', 'message': 'Advisory'}
+    ]}
+
+    assert patch_by_feed(table, items, FeedClient('DONE', report), monkeypatch) == (2, True)
+    assert stored(table, 'B000000001')['patch_attempts'] == 1
+    assert 'pending_bucket' in stored(table, 'B000000001')
+    for asin in ('B000000000', 'B000000002'):
+        assert 'pending_bucket' not in stored(table, asin)
@@ -0,0 +1,88 @@
+"""Checks the vectorised repricing rules against the original per-item implementation.
+
+    python -m pytest test
+"""
+import math
+import os
+import random
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lambda'))
+
+from repricing import (  # noqa: E402
+    reprice_batch, reprice_item, constraint_arrays, REPRICED, ALREADY_FEATURED, NO_PRICE, BELOW_MIN
+)
+
+
+def scalar_prices(featured_offer_price, existing_item):
+    """The rules as price_update_handler applied them one item at a time before reprice_batch"""
+    min_price = float(existing_item.get('min_price', 0))
+    new_price = featured_offer_price - 0.01
+    if new_price <= min_price:
+        return None
+
+    max_price = float(existing_item.get('max_price', float('inf')))
+    if new_price > max_price:
+        new_price = max_price
+
+    business_price = new_price - 0.01
+    min_business_price = float(existing_item.get('min_business_price', 0))
+    max_business_price = float(existing_item.get('max_business_price', float('inf')))
+    if business_price < min_business_price:
+        business_price = min_business_price
+    elif business_price > max_business_price:
+        business_price = max_business_price
+
+    return new_price, business_price
+
+
+def assert_same(featured_price, item):
+    expected = scalar_prices(featured_price, item)
+    actual = reprice_item(featured_price, item)
+    if expected is None:
+        assert actual is None
+    else:
+        assert actual == pytest.approx(expected, abs=1e-9)
+
+
+@pytest.mark.parametrize('featured_price, item', [
+    (20.0, {}),
+    (20.0, {'min_price': 10, 'max_price': 30}),
+    (10.01, {'min_price': 10}),
+    (10.0, {'min_price': 10}),
+    (50.0, {'min_price': 10, 'max_price': 30}),
+    (50.0, {'max_price': 30, 'max_business_price': 25}),
+    (20.0, {'min_business_price': 19.995}),
+    (20.0, {'min_business_price': 25, 'max_business_price': 30}),
+    (20.0, {'max_business_price': 5}),
+    (0.01, {}),
+])
+def test_matches_scalar_rules(featured_price, item):
+    assert_same(featured_price, item)
+
+
+def test_matches_scalar_rules_fuzzed():
+    rng = random.Random(0)
+    names = ['min_price', 'max_price', 'min_business_price', 'max_business_price']
+    for _ in range(5000):
+        item = {name: round(rng.uniform(0, 100), 2) for name in names if rng.random() < 0.6}
+        assert_same(round(rng.uniform(0.01, 120), 2), item)
+
+
+def test_missing_featured_price_is_not_repriced():
+    status, new_prices, business_prices = reprice_batch([float('nan'), 20.0], **constraint_arrays([{}, {}]))
+    assert list(status) == [NO_PRICE, REPRICED]
+    assert math.isnan(new_prices[0]) and math.isnan(business_prices[0])
+    assert reprice_item(None, {}) is None
+
+
+def test_featured_and_below_min_statuses():
+    items = [{}, {'min_price': 30}, {}]
+    status, new_prices, _ = reprice_batch([20.0, 20.0, 20.0], **constraint_arrays(items),
+                                          we_are_featured=[True, False, False])
+    assert list(status) == [ALREADY_FEATURED, BELOW_MIN, REPRICED]
+    assert np.isnan(new_prices[:2]).all()
+    assert new_prices[2] == pytest.approx(19.99)